@@ -1,14 +1,36 @@
+import argparse
+import asyncio
+import hashlib
 import json
 import logging
-import re
-from datetime import datetime
+import os
+import threading
+import time
 from pathlib import Path
 
 import yaml
 from dotenv import load_dotenv
 
+from utils.batches import create_batch_runner
 from utils.build_prompt import PromptBuilder
+from utils.executors import RunDeadline, arun_async, run_async, run_sequential, run_threaded
+from utils.hedging import hedge_policies
 from utils.llm_clients import create_llm_client
+from utils.parse_output import extract_indexed_outputs, extract_output_content
+from utils.manifest import Manifest, load_manifest
+from utils.plan import (
+    build_job,
+    create_plan,
+    estimate_plan,
+    latest_plan,
+    load_plan,
+    plan_settings,
+    shard_jobs,
+    write_plan,
+)
+from utils.retry import retry_budgets
+from utils.stages import Stage, prefetch
+from utils.work_queue import FAILED, LEASED, PENDING, Heartbeat, WorkQueue, worker_id
 
 """
 generate.py - config driven synthetic document generation
@@ -33,28 +55,11 @@ def load_pipeline_config(config_path):
         return yaml.safe_load(f)
 
 
-def extract_output_content(response_text):
-    """
-    Extract content between <OUTPUT> tags
-    """
-    pattern = r"<OUTPUT>(.*?)</OUTPUT>"
-    match = re.search(pattern, response_text, re.DOTALL)
-
-    if match:
-        content = match.group(1).strip()
-        logger.debug(
-            f"Successfully extracted content from <OUTPUT> tags (length={len(content)} chars)"
-        )
-        return content
-    else:
-        logger.warning("No <OUTPUT> tags found in response, using full response text")
-        return response_text.strip()
-
-
-def save_document(output_dir, doc_id, prompt, content=None):
+def save_document(output_dir, doc_id, prompt, content=None, metadata=None):
     """
     Saves output document as JSON file
     If content is None, only saves prompt (debugging prompt-only mode)
+    Any metadata fields are added alongside the standard ones
     """
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -63,57 +68,229 @@ def save_document(output_dir, doc_id, prompt, content=None):
     if content is not None:
         output["content"] = content
 
+    if metadata:
+        output.update(metadata)
+
+    # written under a temporary name so a crash never leaves a partial document
     output_path = output_dir / f"{doc_id}.json"
-    with open(output_path, "w") as f:
+    tmp_path = output_dir / f"{doc_id}.json.tmp"
+    with open(tmp_path, "w") as f:
         json.dump(output, f, indent=2)
+    os.replace(tmp_path, output_path)
 
     logger.debug(f"Saved document to {output_path}")
 
 
-def generate_doc_id(structure_name, profile_id):
+def generate_prompt_id(prompt):
     """
-    Generate unique document ID as {structure}_{profile}_{timestamp}
+    Short stable reference to a prompt, shared by every document generated from it
     """
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:19]
-    return f"{structure_name}_{profile_id}_{timestamp}"
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
 
 
-def main():
-    base_dir = Path(__file__).parent
+def sample_doc_id(doc_id, sample, samples_per_prompt):
+    """
+    Document ID of one sample of a prompt, suffixed _s{sample} when there are several
+    """
+    return doc_id if samples_per_prompt == 1 else f"{doc_id}_s{sample}"
 
-    logger.info("Starting document generation pipeline")
-    print("Loading pipeline.yml...")
-    pipeline_config = load_pipeline_config(str(base_dir / "pipeline.yml"))
 
-    print("Building prompt...")
+def token_cost(provider_config, input_tokens, output_tokens):
+    """
+    Dollar cost of tokens at the provider's price_per_million_tokens, or None without prices
+    """
+    prices = provider_config.get("price_per_million_tokens")
+    if not prices:
+        return None
+    return (
+        input_tokens * prices.get("input", 0) + output_tokens * prices.get("output", 0)
+    ) / 1_000_000
 
-    prompt_template = pipeline_config["prompt_config"].get("prompt_template", "default")
-    enabled_structures = pipeline_config["structure_selection"]["enabled_structures"]
 
+def create_builder(settings):
+    """
+    PromptBuilder with the template, structures and profiles named in plan settings
+    """
     builder = PromptBuilder(
-        template_name=prompt_template, enabled_structures=enabled_structures
+        template_name=settings["prompt_template"],
+        enabled_structures=settings["enabled_structures"],
+    )
+    builder.load_profiles(settings["profile_files"])
+    return builder
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Config driven synthetic document generation")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=("run", "plan", "worker"),
+        default="run",
+        help="'plan' writes the generation plan and estimates its cost; 'run' (default) executes "
+        "one; 'worker' executes jobs from a work queue shared with other workers",
     )
+    parser.add_argument(
+        "--plan",
+        type=Path,
+        help="plan file to execute (run), write (plan) or queue (worker, if the queue is "
+        "empty); without it a fresh plan is made",
+    )
+    parser.add_argument(
+        "--queue",
+        type=Path,
+        help="work queue database for 'worker' (default output/{subdirectory}/queue.sqlite)",
+    )
+    parser.add_argument(
+        "--seed", type=int, help="seed for a new plan, overriding profile_selection.seed"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue the latest plan in the output directory (or --plan), skipping "
+        "documents the manifest records as done and retrying failed ones",
+    )
+    parser.add_argument(
+        "--run-id", help="run ID for a new plan, used in its file name and document IDs"
+    )
+    parser.add_argument("--shard-index", type=int, help="shard of the plan to run, from 0")
+    parser.add_argument("--shard-count", type=int, help="number of shards the plan is split into")
+    args = parser.parse_args()
+
+    if (args.shard_index is None) != (args.shard_count is None):
+        parser.error("--shard-index and --shard-count must be given together")
+    if args.shard_count is not None and not 0 <= args.shard_index < args.shard_count:
+        parser.error("--shard-index must be between 0 and --shard-count - 1")
+    if args.command == "worker" and (args.shard_count is not None or args.resume):
+        parser.error("workers take jobs from the queue; --shard-index and --resume do not apply")
+    return args
 
-    profile_files = pipeline_config["profile_selection"].get("file")
-    builder.load_profiles(profile_files)
 
+def main():
+    args = parse_args()
+    base_dir = Path(__file__).parent
+
+    logger.info("Starting document generation pipeline")
+    print("Loading pipeline.yml...")
+    pipeline_config = load_pipeline_config(str(base_dir / "pipeline.yml"))
+
+    output_dir = base_dir / "output" / pipeline_config["output"]["subdirectory"]
+    llm_config = pipeline_config.get("llm", {})
+    concurrency_config = pipeline_config.get("concurrency", {})
+    provider = llm_config.get("provider", "none")
+
+    # workers share the plan stored in the queue, or queue one if it is empty
+    queue = None
+    if args.command == "worker":
+        # checked before anything is queued, so a refused worker leaves no jobs behind
+        balancing = (llm_config.get("load_balancing") or {}).get("enabled", False)
+        if not llm_config.get("enabled", False) or provider == "none":
+            print("Workers need LLM generation enabled")
+            return
+        if not balancing and (llm_config.get(provider) or {}).get("batch", False):
+            print("Workers call the provider directly; disable batch mode to use the work queue")
+            return
+
+        queue_config = concurrency_config.get("queue") or {}
+        queue = WorkQueue(
+            args.queue or output_dir / "queue.sqlite",
+            queue_config.get("lease_seconds", 300),
+            queue_config.get("max_attempts", 3),
+        )
+        settings = queue.settings()
+
+    # the plan fixes every document's profile, structure and sampled requirements
+    if queue is not None and settings is not None:
+        print(f"Joining work queue {queue.path}")
+        plan_jobs = []
+        builder = create_builder(settings)
+    elif args.command != "plan" and (args.plan or args.resume):
+        plan_path = args.plan or latest_plan(output_dir)
+        if plan_path is None:
+            print(f"No plan to resume in {output_dir}")
+            return
+        print(f"Loading plan from {plan_path}...")
+        settings, plan_jobs = load_plan(plan_path)
+        builder = create_builder(settings)
+    else:
+        print("Planning documents...")
+        settings = plan_settings(pipeline_config, args.seed, args.run_id)
+        # every node draws the same plan, so they must agree on the seed (and so run ID)
+        if args.shard_count is not None and settings["seed"] is None:
+            print("Sharding a new plan needs a fixed seed (--seed or profile_selection.seed)")
+            return
+        builder = create_builder(settings)
+        settings, plan_jobs = create_plan(builder, settings)
+        plan_path = args.plan or output_dir / f"plan_{settings['run_id']}.jsonl"
+        if queue is None:
+            write_plan(plan_path, settings, plan_jobs)
+            print(f"Plan written to {plan_path}")
+
+    if queue is not None and plan_jobs:
+        if queue.populate(settings, plan_jobs):
+            print(f"Queued {len(plan_jobs)} jobs in {queue.path}")
+            if not plan_path.exists():
+                write_plan(plan_path, settings, plan_jobs)
+                print(f"Plan written to {plan_path}")
+        else:
+            # another worker queued its plan first
+            settings = queue.settings()
+            builder = create_builder(settings)
+        plan_jobs = []
+
+    profile_files = settings["profile_files"]
     if profile_files:
         print(f"Loaded profiles from: {', '.join(profile_files)}")
     else:
         print("Loaded all profiles")
 
     print(f"Total profiles: {builder.get_profile_count()}")
-    print(f"Using prompt template: {prompt_template}")
+    print(f"Using prompt template: {settings['prompt_template']}")
+
+    mode = settings["mode"]
+    total_docs = settings["total_docs"]
+    docs_per_call = settings["docs_per_call"]
+    if queue is None:
+        print(
+            f"Plan {settings['run_id']}: {total_docs} documents in {len(plan_jobs)} calls "
+            f"('{mode}' mode, seed {settings['seed']})"
+        )
+    else:
+        print(f"Plan {settings['run_id']}: {total_docs} documents, queue status {queue.counts()}")
+
+    if args.shard_count is not None:
+        plan_jobs = shard_jobs(plan_jobs, args.shard_index, args.shard_count)
+        print(
+            f"Shard {args.shard_index + 1} of {args.shard_count}: "
+            f"{sum(len(job['documents']) for job in plan_jobs)} documents in {len(plan_jobs)} calls"
+        )
+
+    if args.command == "plan":
+        samples_per_prompt = llm_config.get("samples_per_prompt", 1)
+        provider_config = llm_config.get(provider) or {}
+        max_tokens = provider_config.get("max_tokens", 0)
+        calls, input_tokens, output_tokens = estimate_plan(
+            builder, plan_jobs, docs_per_call, max_tokens, samples_per_prompt
+        )
+        print(
+            f"Estimated {provider} usage: {calls} calls, ~{input_tokens} input tokens, "
+            f"up to {output_tokens} output tokens"
+        )
+        cost = token_cost(provider_config, input_tokens, output_tokens)
+        if cost is not None:
+            print(f"Estimated cost: up to ${cost:.2f}")
+        return
 
     # initialise chosen LLM client
-    llm_config = pipeline_config.get("llm", {})
     llm_client = None
 
+    balancing_config = llm_config.get("load_balancing") or {}
+    if balancing_config.get("enabled", False):
+        provider = "+".join(balancing_config.get("weights") or {})
+
     if llm_config.get("enabled", False):
-        provider = llm_config.get("provider", "none")
         try:
             print(f"Initialising LLM client (provider: {provider})...")
-            llm_client = create_llm_client(llm_config)
+            llm_client = create_llm_client(llm_config, concurrency_config, docs_per_call)
             if llm_client:
                 print("LLM client initialised")
                 logger.info(f"LLM client initialised: {provider}")
@@ -127,76 +304,356 @@ def main():
         print("LLM generation disabled (saving prompts only)")
         logger.info("LLM generation disabled")
 
-    output_dir = base_dir / "output" / pipeline_config["output"]["subdirectory"]
     print(f"Output directory: {output_dir}")
 
-    mode = pipeline_config["profile_selection"]["mode"]
-    count = pipeline_config["profile_selection"]["count"]
-    include_style = pipeline_config["prompt_config"]["include_style"]
-    include_content = pipeline_config["prompt_config"]["include_content"]
-
-    total_docs = builder.get_profile_count() if count == -1 else count
+    samples_per_prompt = llm_config.get("samples_per_prompt", 1) if llm_client else 1
 
     action = "documents" if llm_client else "prompts"
-    print(f"Generating {total_docs} {action} in '{mode}' mode...")
+    print(f"Generating {total_docs} {action}...")
     print("#" * 60)
 
-    # todo: can refactor this as sequential and random share identical code
-    if mode == "sequential":
-        for i, profile in enumerate(builder.get_sequential_profiles(), 1):
-            if i > total_docs:
-                break
-            prompt, structure_name, profile_id = builder.build_prompt(
-                profile, include_style, include_content
+    if docs_per_call > 1:
+        print(f"Requesting {docs_per_call} documents per LLM call")
+    if samples_per_prompt > 1:
+        print(f"Saving {samples_per_prompt} samples per prompt")
+
+    counts = {"generated": 0, "failed": 0}
+    deadline = None
+
+    # every saved or failed document is recorded so an interrupted run can be resumed
+    manifest_path = output_dir / "manifest.jsonl"
+    done = set()
+    expected = sum(len(job["documents"]) for job in plan_jobs) * samples_per_prompt
+    if args.resume:
+        statuses = load_manifest(manifest_path)
+        done = {doc_id for doc_id, status in statuses.items() if status == "done"}
+
+        def job_doc_ids(job):
+            return [
+                sample_doc_id(spec["doc_id"], sample, samples_per_prompt)
+                for spec in job["documents"]
+                for sample in range(1, samples_per_prompt + 1)
+            ]
+
+        plan_doc_ids = {doc_id for job in plan_jobs for doc_id in job_doc_ids(job)}
+        previously_failed = sum(
+            1 for doc_id in plan_doc_ids - done if statuses.get(doc_id) == "failed"
+        )
+        done &= plan_doc_ids
+        plan_jobs = [job for job in plan_jobs if not done.issuperset(job_doc_ids(job))]
+        expected = len(plan_doc_ids) - len(done)
+        print(
+            f"Resuming: {len(done)} {action} already done, {len(plan_doc_ids) - len(done)} "
+            f"to generate ({previously_failed} failed previously)"
+        )
+        logger.info(f"Resuming plan {settings['run_id']} with {len(done)} {action} done")
+
+    manifest = Manifest(
+        manifest_path, pipeline_config["output"].get("manifest_sync_seconds", 2.0)
+    )
+
+    stage_config = concurrency_config.get("stages") or {}
+    queue_size = stage_config.get("queue_size", 64)
+    counts_lock = threading.Lock()
+
+    # prompts are built on their own threads, at most queue_size ahead of the LLM calls
+    jobs = prefetch(
+        plan_jobs,
+        lambda job: build_job(builder, job, docs_per_call, samples_per_prompt),
+        stage_config.get("prompt_workers", 2),
+        queue_size,
+    )
+
+    if not llm_client:
+        for job in jobs:
+            for document in job.get("documents", [job]):
+                if document["doc_id"] in done:
+                    continue
+                print(f"[{document['index']}/{total_docs}] Generated: {document['doc_id']}")
+                save_document(output_dir, document["doc_id"], job["prompt"])
+                manifest.record(document["doc_id"], "done")
+                counts["generated"] += 1
+    else:
+        worker = worker_id() if queue is not None else None
+
+        # responses are extracted and written in their own stages, so a slow parser or
+        # disk holds up LLM calls only once queue_size responses are waiting
+        extract_stage = Stage("extract", stage_config.get("extract_workers", 1), queue_size)
+        write_stage = Stage("write", stage_config.get("write_workers", 2), queue_size)
+
+        def save_content(document, prompt, content, metadata=None):
+            """
+            True once the document is saved
+            """
+            try:
+                save_document(output_dir, document["doc_id"], prompt, content, metadata)
+            except OSError as e:
+                on_document_error(document, e)
+                return False
+            logger.info(
+                f"Successfully generated content for {document['doc_id']} (length={len(content)} chars)"
             )
-            doc_id = generate_doc_id(structure_name, profile_id)
+            # write workers print under the lock so progress lines never interleave
+            with counts_lock:
+                print(f"[{document['index']}/{total_docs}] Generated: {document['doc_id']}")
+            manifest.record(document["doc_id"], "done")
+            return True
+
+        def on_document_error(document, e):
+            logger.error(f"Error generating content for {document['doc_id']}: {e}")
+            with counts_lock:
+                print(f"[{document['index']}/{total_docs}] error: {document['doc_id']} - {e}")
+            manifest.record(document["doc_id"], "failed", e)
+
+        def sample_documents(job, sample):
+            documents = job.get("documents", [job])
+            samples = job.get("samples", 1)
+            return [{**d, "doc_id": sample_doc_id(d["doc_id"], sample, samples)} for d in documents]
+
+        def failed_documents(job, e):
+            return [
+                (document, None, e)
+                for sample in range(1, job.get("samples", 1) + 1)
+                for document in sample_documents(job, sample)
+            ]
+
+        # responses from failover or load balancing carry their own provider and model
+        default_provider = llm_client.provider
+        default_model = llm_client.generation_params()["model"]
+
+        def extract(job, response):
+            """
+            Split a response into (document, content, metadata) per document,
+            with content None and the error in place of metadata for failures
+            """
+            samples = job.get("samples", 1)
+            responses = response if samples > 1 else [response]
+            results = []
+
+            for sample, text in enumerate(responses, 1):
+                documents = sample_documents(job, sample)
+                metadata = {
+                    "provider": getattr(text, "provider", None) or default_provider,
+                    "model": getattr(text, "model", None) or default_model,
+                }
+                if samples > 1:
+                    metadata.update(prompt_id=generate_prompt_id(job["prompt"]), sample=sample)
+
+                if "documents" not in job:
+                    results.append((documents[0], extract_output_content(text), metadata))
+                    continue
 
-            content = None
-            if llm_client:
-                try:
-                    logger.info(f"Generating content for {doc_id}")
-                    response = llm_client.generate(prompt)
-                    content = extract_output_content(response)
-                    logger.info(
-                        f"Successfully generated content for {doc_id} (length={len(content)} chars)"
-                    )
-                except Exception as e:
-                    logger.error(f"Error generating content for {doc_id}: {e}")
-                    print(f"[{i}/{total_docs}] error: {doc_id} - {e}")
+                outputs = extract_indexed_outputs(text, len(documents))
+                for document in documents:
+                    content = outputs.get(document["output_id"])
+                    if content is None:
+                        results.append((document, None, "missing or incomplete in response"))
+                    else:
+                        results.append((document, content, metadata))
+
+            for sample in range(len(responses) + 1, samples + 1):
+                for document in sample_documents(job, sample):
+                    results.append((document, None, "sample not returned by provider"))
+            return results
+
+        def extract_job(job, response):
+            try:
+                results, error = extract(job, response), None
+            except Exception as e:
+                results, error = failed_documents(job, e), e
+            write_stage.submit(write_job, job, results, error)
+
+        def write_job(job, results, error=None):
+            saved = failed = 0
+            for document, content, detail in results:
+                # a resumed or retried call can repeat documents already saved
+                if document["doc_id"] in done:
                     continue
+                if content is None:
+                    on_document_error(document, detail)
+                    failed += 1
+                elif save_content(document, job["prompt"], content, detail):
+                    with counts_lock:
+                        done.add(document["doc_id"])
+                    saved += 1
+                else:
+                    failed += 1
+
+            # queued jobs are only finished once their documents are on disk; a job
+            # with any failed document is retried until it runs out of attempts
+            final = True
+            if queue is not None:
+                if failed:
+                    status = queue.fail(
+                        job["queue_id"],
+                        worker,
+                        error or f"{failed} of {len(results)} documents failed",
+                    )
+                    final = status == FAILED
+                elif not queue.complete(job["queue_id"], worker):
+                    logger.warning(f"Lease on {job['doc_id']} expired before it completed")
 
-            print(f"[{i}/{total_docs}] Generated: {doc_id}")
-            save_document(output_dir, doc_id, prompt, content)
+            # failures are counted once they are final, not on every attempt
+            with counts_lock:
+                counts["generated"] += saved
+                if final:
+                    counts["failed"] += failed
 
-    elif mode == "random":
-        for i in range(1, total_docs + 1):
-            profile = builder.get_random_profile()
-            prompt, structure_name, profile_id = builder.build_prompt(
-                profile, include_style, include_content
+        def on_success(job, response):
+            extract_stage.submit(extract_job, job, response)
+
+        def on_error(job, e):
+            write_stage.submit(write_job, job, failed_documents(job, e), e)
+
+        execution_mode = concurrency_config.get("mode", "sequential")
+
+        deadline_minutes = concurrency_config.get("deadline_minutes")
+        if deadline_minutes:
+            deadline = RunDeadline(
+                deadline_minutes * 60, concurrency_config.get("deadline_grace_seconds", 60)
             )
-            doc_id = generate_doc_id(structure_name, profile_id)
+            print(f"Run deadline: {deadline_minutes} minutes")
+        max_in_flight = concurrency_config.get("max_in_flight", 8)
+
+        # with adaptive control the client gates calls, so run enough workers for its ceiling
+        adaptive_config = concurrency_config.get("adaptive") or {}
+        if adaptive_config.get("enabled", False):
+            max_in_flight = adaptive_config.get("max", 64)
+            print(f"Adaptive concurrency enabled (ceiling: {max_in_flight})")
+
+        def flush():
+            # extract hands its documents to write, so it is drained first
+            extract_stage.join()
+            write_stage.join()
+
+        def execute(jobs, on_success, on_error):
+            if (llm_config.get(provider) or {}).get("batch", False):
+                if samples_per_prompt > 1:
+                    raise ValueError("samples_per_prompt > 1 is not supported in batch mode")
+                print(f"Running {provider} batch generation")
+                runner = create_batch_runner(
+                    provider, llm_config, output_dir, docs_per_call, settings["run_id"]
+                )
+                runner.run(jobs, on_success, on_error, flush)
+            elif execution_mode == "sequential":
+                run_sequential(llm_client, jobs, on_success, on_error, deadline)
+            elif execution_mode == "async":
+                print(f"Running async generation (max_in_flight: {max_in_flight})")
+                run_async(llm_client, jobs, on_success, on_error, max_in_flight, deadline)
+            elif execution_mode == "threads":
+                print(f"Running threaded generation (workers: {max_in_flight})")
+                run_threaded(
+                    lambda: create_llm_client(llm_config, concurrency_config, docs_per_call),
+                    jobs,
+                    on_success,
+                    on_error,
+                    max_in_flight,
+                    deadline,
+                )
+            else:
+                raise ValueError(f"Unknown concurrency mode: {execution_mode}")
 
-            content = None
-            if llm_client:
+        try:
+            if queue is None:
+                execute(jobs, on_success, on_error)
+            else:
+                queue_config = concurrency_config.get("queue") or {}
+                print(f"Worker {worker} taking jobs from {queue.path}")
+
+                # leased one at a time as executor slots free up, so a worker never
+                # holds jobs it is not yet working on
+                def leased_jobs():
+                    while True:
+                        leased = queue.lease(worker)
+                        if leased is None:
+                            return
+                        job_id, job = leased
+                        yield {
+                            **build_job(builder, job, docs_per_call, samples_per_prompt),
+                            "queue_id": job_id,
+                        }
+
+                def drained():
+                    """
+                    Wait for this pass's documents to be written, then True if
+                    the worker is finished: no jobs left to run, or the deadline
+                    """
+                    flush()
+                    status = queue.counts()
+                    if not (status[PENDING] or status[LEASED]):
+                        return True
+                    return deadline is not None and deadline.reached
+
+                # jobs leased by other workers are re-queued if their leases expire
+                poll_seconds = queue_config.get("poll_seconds", 10)
+
+                # async clients are bound to the event loop they first run on, so
+                # every pass runs on one loop instead of a new one per pass
+                async def adrain():
+                    print(f"Running async generation (max_in_flight: {max_in_flight})")
+                    while True:
+                        await arun_async(
+                            llm_client, leased_jobs(), on_success, on_error, max_in_flight, deadline
+                        )
+                        if await asyncio.to_thread(drained):
+                            return
+                        await asyncio.sleep(poll_seconds)
+
+                heartbeat = Heartbeat(queue, worker, queue_config.get("heartbeat_seconds", 30))
                 try:
-                    logger.info(f"Generating content for {doc_id}")
-                    response = llm_client.generate(prompt)
-                    content = extract_output_content(response)
-                    logger.info(
-                        f"Successfully generated content for {doc_id} (length={len(content)} chars)"
-                    )
-                except Exception as e:
-                    logger.error(f"Error generating content for {doc_id}: {e}")
-                    print(f"[{i}/{total_docs}] error: {doc_id} - {e}")
-                    continue
-
-            print(f"[{i}/{total_docs}] Generated: {doc_id}")
-            save_document(output_dir, doc_id, prompt, content)
+                    if execution_mode == "async":
+                        asyncio.run(adrain())
+                    else:
+                        while True:
+                            execute(leased_jobs(), on_success, on_error)
+                            if drained():
+                                break
+                            time.sleep(poll_seconds)
+                finally:
+                    heartbeat.stop()
+        finally:
+            extract_stage.close()
+            write_stage.close()
+
+    manifest.close()
 
     print("#" * 60)
-    print(f"Generated {total_docs} {action}")
+    print(f"Generated {counts['generated']} {action}, {counts['failed']} failed")
+    if queue is not None:
+        print(f"Work queue status: {queue.counts()}")
+    elif counts["failed"] or (deadline is not None and deadline.reached):
+        print("Run 'python generate.py run --resume' to retry failed and unfinished documents")
+    if queue is None and deadline is not None and deadline.reached:
+        not_started = expected - counts["generated"] - counts["failed"]
+        print(f"Run deadline reached: {not_started} {action} not started")
+    for budget in retry_budgets():
+        if budget.requests:
+            print(
+                f"Retries ({budget.provider}): {budget.retries} over {budget.requests} requests "
+                f"({budget.exhausted} refused by retry budget)"
+            )
+    for policy in hedge_policies():
+        if policy.hedges:
+            # losing calls are billed for their output as well as their prompt
+            extra = (
+                f"~{policy.extra_input_tokens} extra input and "
+                f"~{policy.extra_output_tokens} extra output tokens"
+            )
+            cost = token_cost(
+                llm_config.get(policy.provider) or {},
+                policy.extra_input_tokens,
+                policy.extra_output_tokens,
+            )
+            if cost is not None:
+                extra += f" (~${cost:.2f})"
+            print(
+                f"Hedges ({policy.provider}): {policy.hedges} over {policy.requests} requests, "
+                f"{policy.hedges_won} won, {extra}"
+            )
     print(f"Saved to: {output_dir}")
-    logger.info(f"Pipeline completed successfully. Generated {total_docs} {action}")
+    logger.info(
+        f"Pipeline completed. Generated {counts['generated']} {action}, {counts['failed']} failed"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,329 @@
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+
+from utils.build_prompt import Prompt
+
+"""
+batches.py - provider batch APIs: submit all prompts up front, poll, then collect
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRunner(ABC):
+    """
+    Base class for running jobs through a provider's asynchronous batch API.
+
+    Progress is kept in a JSON state file: every job (keyed by custom_id)
+    and every submitted batch. The file is rewritten after each submission
+    and each collected batch, so a restarted run resumes polling the batches
+    already submitted and submits only the jobs that never were.
+    """
+
+    def __init__(self, client, state_path, chunk_size=500, poll_interval=60):
+        """
+        Args:
+            client:
+                Provider LLMClient (unwrapped)
+            state_path:
+                Path of the JSON state file used for resumption
+            chunk_size:
+                Maximum number of requests per submitted batch
+            poll_interval:
+                Seconds between status checks
+        """
+        self.client = client
+        self.state_path = state_path
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+
+    @abstractmethod
+    def submit(self, requests):
+        """
+        Submit a list of (custom_id, prompt) pairs and return the batch ID
+        """
+        pass
+
+    @abstractmethod
+    def is_finished(self, batch_id):
+        """
+        Return True once the batch has stopped processing
+        """
+        pass
+
+    @abstractmethod
+    def results(self, batch_id):
+        """
+        Yield (custom_id, response_text, error) for every request in a finished
+        batch; exactly one of response_text and error is not None
+        """
+        pass
+
+    def load_state(self):
+        """
+        Load the state file, or return None if there is no run to resume
+        """
+        if not self.state_path.exists():
+            return None
+        with open(self.state_path, "r") as f:
+            state = json.load(f)
+        # JSON keeps only the prompt text, so restore the cacheable prefix it records
+        for job in state["jobs"].values():
+            job["prompt"] = Prompt(job["prompt"], job.get("prefix_length", 0))
+        return state
+
+    def save_state(self, state):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self, jobs, on_success, on_error, flush=None):
+        """
+        Submit jobs (or resume a previous submission) and hand every result
+        to the callbacks
+
+        Args:
+            jobs:
+                Iterable of job dicts with 'index', 'doc_id' and 'prompt'; when
+                resuming from an existing state file they must be among its jobs
+            on_success:
+                Callback (job, response) invoked for each successful request
+            on_error:
+                Callback (job, exception) invoked for each failed request
+            flush:
+                Optional callback that returns once the results handed to
+                on_success and on_error are written; a batch is only marked
+                collected after it, so an interrupted run never skips results
+                that were still queued
+        """
+        jobs = {
+            f"job-{job['index']}": {
+                **job,
+                "prefix_length": getattr(job["prompt"], "prefix_length", 0),
+            }
+            for job in jobs
+        }
+        state = self.load_state()
+        if state is None:
+            state = {"jobs": jobs, "batches": []}
+            self.save_state(state)
+            logger.info(f"Submitting {len(state['jobs'])} requests as batches")
+        else:
+            # a resumed plan may have fewer jobs left, but never ones the state lacks
+            unknown = set(jobs) - set(state["jobs"])
+            if unknown:
+                raise ValueError(
+                    f"{self.state_path} belongs to a different set of jobs "
+                    f"({len(unknown)} not in it); remove it to start a new batch run"
+                )
+            logger.info(f"Resuming batch run from {self.state_path}")
+
+        self._submit_remaining(state)
+        self._collect(state, on_success, on_error, flush)
+
+        self.state_path.unlink()
+        logger.info("Batch run complete, removed state file")
+
+    def _submit_remaining(self, state):
+        submitted = {cid for batch in state["batches"] for cid in batch["custom_ids"]}
+        remaining = [cid for cid in state["jobs"] if cid not in submitted]
+
+        for start in range(0, len(remaining), self.chunk_size):
+            custom_ids = remaining[start : start + self.chunk_size]
+            requests = [(cid, state["jobs"][cid]["prompt"]) for cid in custom_ids]
+            batch_id = self.submit(requests)
+            state["batches"].append({"id": batch_id, "custom_ids": custom_ids, "done": False})
+            self.save_state(state)
+            logger.info(f"Submitted batch {batch_id} with {len(custom_ids)} requests")
+
+    def _collect(self, state, on_success, on_error, flush):
+        pending = [batch for batch in state["batches"] if not batch["done"]]
+
+        while pending:
+            for batch in list(pending):
+                if not self.is_finished(batch["id"]):
+                    continue
+
+                logger.info(f"Batch {batch['id']} finished, collecting results")
+                seen = set()
+                for custom_id, response, error in self.results(batch["id"]):
+                    job = state["jobs"].get(custom_id)
+                    if job is None:
+                        logger.warning(f"Batch {batch['id']} returned unknown custom_id {custom_id}")
+                        continue
+                    seen.add(custom_id)
+                    if error is not None:
+                        on_error(job, error)
+                        continue
+                    try:
+                        on_success(job, response)
+                    except Exception as e:
+                        on_error(job, e)
+
+                for custom_id in batch["custom_ids"]:
+                    if custom_id not in seen:
+                        on_error(state["jobs"][custom_id], RuntimeError("No result returned in batch"))
+
+                if flush is not None:
+                    flush()
+                batch["done"] = True
+                self.save_state(state)
+                pending.remove(batch)
+
+            if pending:
+                logger.debug(f"{len(pending)} batches still processing")
+                time.sleep(self.poll_interval)
+
+
+class ClaudeBatchRunner(BatchRunner):
+    """
+    Anthropic Message Batches API
+    """
+
+    def submit(self, requests):
+        batch = self.client.client.messages.batches.create(
+            requests=[
+                {"custom_id": custom_id, "params": self.client.message_params(prompt)}
+                for custom_id, prompt in requests
+            ]
+        )
+        return batch.id
+
+    def is_finished(self, batch_id):
+        batch = self.client.client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        logger.debug(
+            f"Batch {batch_id}: {batch.processing_status} "
+            f"(processing={counts.processing}, succeeded={counts.succeeded}, errored={counts.errored})"
+        )
+        return batch.processing_status == "ended"
+
+    def results(self, batch_id):
+        for entry in self.client.client.messages.batches.results(batch_id):
+            result = entry.result
+            if result.type == "succeeded":
+                yield entry.custom_id, self.client.response_text(result.message), None
+            elif result.type == "errored":
+                yield entry.custom_id, None, RuntimeError(f"Batch request errored: {result.error}")
+            else:
+                yield entry.custom_id, None, RuntimeError(f"Batch request {result.type}")
+
+
+class LocalBatchRunner(BatchRunner):
+    """
+    OpenAI-compatible /v1/batches API (e.g. vLLM) behind LocalClient.
+    Requests are written to a JSONL file, uploaded and run as one batch job.
+    """
+
+    endpoint = "/v1/chat/completions"
+    finished_statuses = ("completed", "failed", "expired", "cancelled")
+
+    def submit(self, requests):
+        input_path = self.state_path.with_name(f"{self.state_path.stem}_input.jsonl")
+        with open(input_path, "w") as f:
+            for custom_id, prompt in requests:
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": self.endpoint,
+                    "body": self.client.completion_params(prompt),
+                }
+                f.write(json.dumps(line) + "\n")
+
+        try:
+            with open(input_path, "rb") as f:
+                input_file = self.client.client.files.create(file=f, purpose="batch")
+        finally:
+            input_path.unlink()
+
+        batch = self.client.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=self.endpoint,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def is_finished(self, batch_id):
+        batch = self.client.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        if counts:
+            logger.debug(
+                f"Batch {batch_id}: {batch.status} "
+                f"(completed={counts.completed}, failed={counts.failed}, total={counts.total})"
+            )
+        if batch.status in ("failed", "expired", "cancelled"):
+            logger.error(f"Batch {batch_id} ended with status {batch.status}: {batch.errors}")
+        return batch.status in self.finished_statuses
+
+    def results(self, batch_id):
+        batch = self.client.client.batches.retrieve(batch_id)
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = self.client.client.files.content(file_id).text
+            for line in content.splitlines():
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                response = entry.get("response") or {}
+                if entry.get("error") or response.get("status_code") != 200:
+                    error = entry.get("error") or response.get("body")
+                    yield entry["custom_id"], None, RuntimeError(f"Batch request failed: {error}")
+                else:
+                    choice = response["body"]["choices"][0]
+                    message = self.client.restore_stop_sequence(
+                        choice["message"]["content"], choice.get("finish_reason")
+                    )
+                    yield entry["custom_id"], message, None
+
+
+BATCH_RUNNERS = {"claude": ClaudeBatchRunner, "local": LocalBatchRunner}
+
+
+def create_batch_runner(provider, llm_config, output_dir, outputs_per_response=1, run_id=None):
+    """
+    Create the batch runner for a provider with batch: true in pipeline.yml
+
+    Args:
+        provider:
+            Provider name
+        llm_config:
+            Dictionary containing LLM configuration from pipeline.yml
+        output_dir:
+            Run output directory, where the resumable state file is kept
+        outputs_per_response:
+            Number of <OUTPUT> documents expected in each response
+        run_id:
+            Plan run ID, so each plan keeps its own state file
+
+    Returns:
+        BatchRunner instance
+    """
+    from utils.endpoint_pool import EndpointPool
+    from utils.llm_clients import create_provider_client
+
+    if provider not in BATCH_RUNNERS:
+        raise ValueError(f"Batch mode is not supported for provider: {provider}")
+
+    config = llm_config[provider]
+    client = create_provider_client(provider, llm_config, outputs_per_response)
+    if isinstance(client, EndpointPool):
+        # a batch and its files live on one server, so submit to the first replica
+        # every time and a resumed run polls the server that holds its batches
+        client = client.client
+        logger.info(f"Running batch on local replica {client.base_url}")
+
+    return BATCH_RUNNERS[provider](
+        client,
+        output_dir / (
+            f"{provider}_batch_state_{run_id}.json" if run_id else f"{provider}_batch_state.json"
+        ),
+        chunk_size=config.get("batch_chunk_size", 500),
+        poll_interval=config.get("batch_poll_interval", 60),
+    )
@@ -1,3 +1,4 @@
+import random
 from pathlib import Path
 from utils.load_sampling import ConfigSampler
 from utils.load_profiles import ProfileLoader
@@ -8,6 +9,17 @@ build_prompt.py - assembles complete prompts from all components
 """
 
 
+class Prompt(str):
+    """
+    Prompt text that records where its static, cacheable prefix ends
+    """
+
+    def __new__(cls, text, prefix_length=0):
+        prompt = super().__new__(cls, text)
+        prompt.prefix_length = prefix_length
+        return prompt
+
+
 class PromptBuilder:
     def __init__(self, template_name='default', enabled_structures=None):
         self.config_sampler = ConfigSampler()
@@ -15,10 +27,15 @@ class PromptBuilder:
         self.structure_loader = StructureLoader(enabled_structures)
         self.structure_loader.load_structures()
 
-        template_path = Path(__file__).parent.parent / 'prompts' / f'{template_name}.md'
+        self.template_name = template_name
+        self.template_dir = Path(__file__).parent.parent / 'prompts'
+        template_path = self.template_dir / f'{template_name}.md'
         with open(template_path, 'r') as f:
             self.template = f.read()
 
+        # {template_name}_multi.md, loaded on first multi-document prompt
+        self.multi_template = None
+
     def load_profiles(self, profile_files=None):
         """
         Load profiles from specified file(s) or all profiles
@@ -34,11 +51,11 @@ class PromptBuilder:
         """
         return self.profile_loader.get_profile_count()
 
-    def get_random_profile(self):
+    def get_random_profile(self, rng=random):
         """
         Get random profile when using random mode
         """
-        return self.profile_loader.get_random_profile()
+        return self.profile_loader.get_random_profile(rng)
 
     def get_sequential_profiles(self):
         """
@@ -46,33 +63,127 @@ class PromptBuilder:
         """
         return self.profile_loader.get_sequential_profiles()
 
-    def build_prompt(self, profile, include_style=True, include_content=True):
+    def sample_document(self, profile, rng=random, include_style=True, include_content=True):
         """
-        Assemble complete prompt for a given profile
+        Draw the structure and style/content requirements for one document
+        Returns a compact spec (profile, structure filename and sampled keys)
+        from which build_planned_prompt rebuilds the same prompt
         """
-        # style / content
-        style_prompt, content_prompt = self.config_sampler.generate_prompts()
+        style_config = self.config_sampler.sample_style_config(rng)
+        content_config = self.config_sampler.sample_content_config(rng)
+        structure_filename, _ = self.structure_loader.get_random_structure(rng)
+
+        spec = {
+            'profile': profile['profile_id'],
+            'profile_file': profile['source_file'],
+            'structure': structure_filename,
+        }
+        if include_style:
+            spec['style'] = self.config_sampler.sampled_keys(style_config)
+        if include_content:
+            spec['content'] = self.config_sampler.sampled_keys(content_config)
+        return spec
+
+    def _build_components(self, spec):
+        """
+        Format the parts of a document spec
+        Returns structure name, structure prompt and the remaining instructions
+        """
+        sampler = self.config_sampler
+        profile = self.profile_loader.get_profile(spec['profile_file'], spec['profile'])
 
         # profile
         profile_prompt = self.profile_loader.format_profile_prompt(profile)
 
         # get structure
-        structure_filename, structure_content = self.structure_loader.get_random_structure()
+        structure_filename = spec['structure']
+        structure_content = self.structure_loader.structures[structure_filename]
         structure_name = self.structure_loader.get_structure_name_without_extension(structure_filename)
         structure_prompt = self.structure_loader.format_structure_prompt(structure_content)
 
-        # assemble!
         components = []
 
-        if include_style:
-            components.append(style_prompt)
+        # style / content
+        if 'style' in spec:
+            components.append(sampler.format_style_prompt(sampler.style_config_from_keys(spec['style'])))
 
-        if include_content:
-            components.append(content_prompt)
+        if 'content' in spec:
+            components.append(
+                sampler.format_content_prompt(sampler.content_config_from_keys(spec['content']))
+            )
 
-        components.extend([profile_prompt, structure_prompt])
+        components.append(profile_prompt)
 
-        specific_instructions = '\n\n'.join(components)
-        complete_prompt = self.template.format(specific_instructions=specific_instructions)
+        return structure_name, structure_prompt, '\n\n'.join(components)
 
-        return complete_prompt, structure_name, profile['profile_id']
+    def build_prompt(self, profile, include_style=True, include_content=True):
+        """
+        Assemble complete prompt for a given profile
+        """
+        spec = self.sample_document(profile, random, include_style, include_content)
+        return self.build_planned_prompt(spec)
+
+    def build_planned_prompt(self, spec):
+        """
+        Assemble the complete prompt for a document spec from sample_document
+        """
+        structure_name, structure_prompt, specific_instructions = self._build_components(spec)
+
+        # assemble!
+        # templates with a {structure_instructions} slot put the structure
+        # straight after the static text, so the prompt prefix only varies by
+        # structure and can be cached by the provider
+        head = self.template.split('{specific_instructions}', 1)[0]
+
+        if '{structure_instructions}' in self.template:
+            complete_prompt = self.template.format(
+                structure_instructions=structure_prompt,
+                specific_instructions=specific_instructions,
+            )
+            static_prefix = head.format(structure_instructions=structure_prompt)
+        else:
+            specific_instructions = f'{specific_instructions}\n\n{structure_prompt}'
+            complete_prompt = self.template.format(specific_instructions=specific_instructions)
+            static_prefix = head
+
+        prompt = Prompt(complete_prompt, prefix_length=len(static_prefix))
+        return prompt, structure_name, spec['profile']
+
+    def build_multi_prompt(self, profiles, include_style=True, include_content=True):
+        """
+        Assemble one prompt asking for a document per profile, each to be
+        returned in <OUTPUT id="n"> tags numbered from 1
+        Returns the prompt and a list of (structure_name, profile_id) per document
+        """
+        specs = [
+            self.sample_document(profile, random, include_style, include_content)
+            for profile in profiles
+        ]
+        return self.build_planned_multi_prompt(specs)
+
+    def build_planned_multi_prompt(self, specs):
+        """
+        Assemble one prompt asking for a document per spec from sample_document
+        Returns the prompt and a list of (structure_name, profile_id) per document
+        """
+        if self.multi_template is None:
+            template_path = self.template_dir / f'{self.template_name}_multi.md'
+            with open(template_path, 'r') as f:
+                self.multi_template = f.read()
+
+        sections = []
+        documents = []
+        for n, spec in enumerate(specs, 1):
+            structure_name, structure_prompt, specific_instructions = self._build_components(spec)
+            sections.append(f'# DOCUMENT {n}\n\n{structure_prompt}\n\n{specific_instructions}')
+            documents.append((structure_name, spec['profile']))
+
+        document_count = len(documents)
+        head = self.multi_template.split('{documents}', 1)[0]
+        static_prefix = head.format(document_count=document_count)
+        complete_prompt = self.multi_template.format(
+            document_count=document_count, documents='\n\n'.join(sections)
+        )
+
+        prompt = Prompt(complete_prompt, prefix_length=len(static_prefix))
+        return prompt, documents
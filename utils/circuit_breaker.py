@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+
+from utils.llm_clients import ClientWrapper, tag_responses
+from utils.retry import is_retryable
+
+"""
+circuit_breaker.py - stop calling a failing provider and fail over to a fallback
+"""
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when every provider's circuit is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker.
+
+    Closed: requests flow; failure_threshold consecutive outage failures
+    (errors that is_retryable() accepts, after any retries) open it.
+    Open: requests are refused until reset_timeout has passed.
+    Half-open: up to half_open_probes trial requests are let through; a
+    success closes the circuit, a failure opens it again.
+
+    Fatal errors such as bad requests show the provider is reachable, so
+    they count as successes here.
+    """
+
+    def __init__(self, provider, failure_threshold=5, reset_timeout=60.0, half_open_probes=1):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probes = 0
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        True if a request may be sent now; the caller must then report the
+        outcome with record(), or abandon() if it never completed
+        """
+        with self.lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self.probes = 0
+                logger.info(f"Circuit for {self.provider} half-open, probing")
+
+            if self.state == HALF_OPEN:
+                if self.probes >= self.half_open_probes:
+                    return False
+                self.probes += 1
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                logger.info(f"Circuit for {self.provider} closed, provider recovered")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self, error):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                logger.warning(
+                    f"Circuit for {self.provider} opened for {self.reset_timeout:.0f}s "
+                    f"after {self.failures} failures: {error}"
+                )
+
+    def abandon(self):
+        """
+        Give back a half-open probe whose request was cancelled without an outcome
+        """
+        with self.lock:
+            if self.state == HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def record(self, error):
+        """
+        Report the outcome of an allowed request (error is None on success)
+        """
+        if error is not None and is_retryable(error, self.provider):
+            self.record_failure(error)
+        else:
+            self.record_success()
+
+
+def get_circuit_breaker(provider, breaker_config):
+    """
+    Return the process-wide CircuitBreaker for a provider, creating it on first use.
+
+    Args:
+        provider:
+            Provider name, used as the sharing key
+        breaker_config:
+            llm.circuit_breaker section of pipeline.yml
+    """
+    with _breakers_lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(
+                provider,
+                failure_threshold=breaker_config.get("failure_threshold", 5),
+                reset_timeout=breaker_config.get("reset_timeout", 60.0),
+                half_open_probes=breaker_config.get("half_open_probes", 1),
+            )
+        return _breakers[provider]
+
+
+class FailoverClient(ClientWrapper):
+    """
+    Sends each request to the first provider in routes whose circuit allows
+    it, moving on to the next provider when a request fails with an outage
+    error. Wraps the primary route's client, so attributes such as model
+    and max_tokens are the primary provider's; responses are tagged with
+    the provider that actually produced them.
+
+    Subclasses can change the order routes are tried in per request
+    (request_routes) and add behaviour around each attempt (call_route).
+    """
+
+    def __init__(self, routes):
+        """
+        Args:
+            routes:
+                List of (CircuitBreaker, LLMClient) pairs in order of preference
+        """
+        super().__init__(routes[0][1])
+        self.routes = routes
+
+    def request_routes(self):
+        """
+        Routes to try for the next request, in order
+        """
+        return self.routes
+
+    def call_route(self, client, prompt, n):
+        return client.generate_samples(prompt, n)
+
+    async def acall_route(self, client, prompt, n):
+        return await client.agenerate_samples(prompt, n)
+
+    def generate_samples(self, prompt, n):
+        last_error = None
+        for breaker, client in self.request_routes():
+            if not breaker.allow():
+                continue
+            try:
+                responses = self.call_route(client, prompt, n)
+            except BaseException as e:
+                # interrupted without an outcome
+                if not isinstance(e, Exception):
+                    breaker.abandon()
+                    raise
+                breaker.record(e)
+                if not is_retryable(e, breaker.provider):
+                    raise
+                last_error = e
+                continue
+            breaker.record(None)
+            return tag_responses(responses, client)
+
+        raise last_error or CircuitOpenError("Circuit open for every provider")
+
+    async def agenerate_samples(self, prompt, n):
+        last_error = None
+        for breaker, client in self.request_routes():
+            if not breaker.allow():
+                continue
+            try:
+                responses = await self.acall_route(client, prompt, n)
+            except BaseException as e:
+                # cancelled without an outcome
+                if not isinstance(e, Exception):
+                    breaker.abandon()
+                    raise
+                breaker.record(e)
+                if not is_retryable(e, breaker.provider):
+                    raise
+                last_error = e
+                continue
+            breaker.record(None)
+            return tag_responses(responses, client)
+
+        raise last_error or CircuitOpenError("Circuit open for every provider")
@@ -0,0 +1,288 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from utils.llm_clients import ClientWrapper, error_status_code
+
+"""
+concurrency.py - adaptive (AIMD) control of in-flight LLM requests per provider
+"""
+
+logger = logging.getLogger(__name__)
+
+# starting points before the controller has any observations
+DEFAULT_INITIAL_LIMITS = {"gemini": 8, "claude": 4, "local": 4, "llamacpp": 2}
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def is_overload_error(error):
+    """
+    True for errors that indicate the provider is saturated (429, 5xx, timeouts)
+    """
+    status = error_status_code(error)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower()
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a non-empty list
+    """
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class AdaptiveLimit:
+    """
+    Additive-increase/multiplicative-decrease limit on concurrent requests.
+
+    Completions are collected into windows. After each window the limit
+    grows by one if the limit was reached and the window was healthy, and
+    is multiplied by decrease_factor if the overload error rate was above
+    max_error_rate, or p95 latency has been above latency_tolerance times
+    the baseline for degraded_windows windows in a row. The baseline is the
+    lowest p95 of the last baseline_windows windows, so it follows the
+    provider's latency as it drifts and one fast window does not set the
+    bar for the rest of the run.
+
+    Latencies are counted per attempt, while the error rate is counted per
+    logical request (see AdaptiveOutcomeClient), so errors that a retry
+    recovers from do not count against the limit. Requests started before
+    the last adjustment are not counted, so each window reflects the
+    current limit.
+    """
+
+    def __init__(
+        self,
+        provider,
+        initial=4,
+        minimum=1,
+        maximum=64,
+        window=20,
+        latency_tolerance=2.0,
+        max_error_rate=0.05,
+        decrease_factor=0.5,
+        baseline_windows=50,
+        degraded_windows=2,
+    ):
+        if not 1 <= minimum <= maximum:
+            raise ValueError(f"Invalid adaptive bounds: min={minimum}, max={maximum}")
+
+        self.provider = provider
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = min(max(initial, minimum), maximum)
+        self.window = window
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.degraded_windows = degraded_windows
+
+        self.in_flight = 0
+        self.saturated = False
+        self.recent_p95 = deque(maxlen=baseline_windows)
+        self.slow_windows = 0
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+        self.adjusted_at = time.monotonic()
+
+        self.condition = threading.Condition()
+        self.async_condition = None
+
+        logger.info(
+            f"Initialised AdaptiveLimit for {provider} with limit={self.limit} "
+            f"(min={minimum}, max={maximum})"
+        )
+
+    def _try_enter(self):
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        if self.in_flight >= self.limit:
+            self.saturated = True
+        return True
+
+    def acquire(self):
+        """
+        Block until a slot is free
+        """
+        with self.condition:
+            self.condition.wait_for(self._try_enter)
+
+    async def aacquire(self):
+        """
+        Wait on the event loop until a slot is free
+        """
+        if self.async_condition is None:
+            self.async_condition = asyncio.Condition()
+        async with self.async_condition:
+            while True:
+                with self.condition:
+                    if self._try_enter():
+                        return
+                await self.async_condition.wait()
+
+    def release(self, latency, error=None):
+        """
+        Free a slot and record the latency of the attempt
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if time.monotonic() - latency < self.adjusted_at:
+                self.condition.notify_all()
+                return
+
+            # errors the provider answers straight away (400s etc.) say nothing about load
+            if error is None or is_overload_error(error):
+                self.latencies.append(latency)
+
+            if len(self.latencies) >= self.window:
+                self._adjust()
+            self.condition.notify_all()
+
+    async def arelease(self, latency, error=None):
+        self.release(latency, error)
+        async with self.async_condition:
+            self.async_condition.notify_all()
+
+    def record_outcome(self, duration, error=None):
+        """
+        Record the outcome of a logical request, after any retries
+        """
+        with self.condition:
+            if time.monotonic() - duration < self.adjusted_at:
+                return
+            self.requests += 1
+            if error is not None and is_overload_error(error):
+                self.errors += 1
+
+    def _adjust(self):
+        p95 = percentile(self.latencies, 95)
+        error_rate = self.errors / self.requests if self.requests else 0.0
+        baseline = min(self.recent_p95) if self.recent_p95 else p95
+        self.recent_p95.append(p95)
+
+        if p95 > baseline * self.latency_tolerance:
+            self.slow_windows += 1
+        else:
+            self.slow_windows = 0
+
+        old_limit = self.limit
+        if error_rate > self.max_error_rate or self.slow_windows >= self.degraded_windows:
+            self.limit = max(self.minimum, int(self.limit * self.decrease_factor))
+            self.slow_windows = 0
+        elif self.saturated and not self.slow_windows:
+            self.limit = min(self.maximum, self.limit + 1)
+
+        logger.info(
+            f"Adaptive limit for {self.provider}: {old_limit} -> {self.limit} "
+            f"(p95={p95:.2f}s, baseline_p95={baseline:.2f}s, error_rate={error_rate:.1%})"
+        )
+
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+        self.saturated = self.in_flight >= self.limit
+        self.adjusted_at = time.monotonic()
+
+
+def get_adaptive_limit(provider, adaptive_config):
+    """
+    Return the process-wide AdaptiveLimit for a provider, creating it on first use.
+
+    Args:
+        provider:
+            Provider name, used as the sharing key and to pick the initial limit
+        adaptive_config:
+            concurrency.adaptive section of pipeline.yml
+    """
+    with _limits_lock:
+        if provider not in _limits:
+            _limits[provider] = AdaptiveLimit(
+                provider,
+                initial=adaptive_config.get(
+                    "initial", DEFAULT_INITIAL_LIMITS.get(provider, 4)
+                ),
+                minimum=adaptive_config.get("min", 1),
+                maximum=adaptive_config.get("max", 64),
+                window=adaptive_config.get("window", 20),
+                latency_tolerance=adaptive_config.get("latency_tolerance", 2.0),
+                max_error_rate=adaptive_config.get("max_error_rate", 0.05),
+                decrease_factor=adaptive_config.get("decrease_factor", 0.5),
+                baseline_windows=adaptive_config.get("baseline_windows", 50),
+                degraded_windows=adaptive_config.get("degraded_windows", 2),
+            )
+        return _limits[provider]
+
+
+class AdaptiveConcurrencyClient(ClientWrapper):
+    """
+    Wraps any LLMClient so concurrent calls are gated by an AdaptiveLimit
+    """
+
+    def __init__(self, client, limit):
+        super().__init__(client)
+        self.limit = limit
+
+    def generate_samples(self, prompt, n):
+        self.limit.acquire()
+        start = time.monotonic()
+        error = None
+        try:
+            return self.client.generate_samples(prompt, n)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self.limit.release(time.monotonic() - start, error)
+
+    async def agenerate_samples(self, prompt, n):
+        await self.limit.aacquire()
+        start = time.monotonic()
+        error = None
+        try:
+            return await self.client.agenerate_samples(prompt, n)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            await self.limit.arelease(time.monotonic() - start, error)
+
+
+class AdaptiveOutcomeClient(ClientWrapper):
+    """
+    Wraps the retry layer around an AdaptiveConcurrencyClient so the
+    AdaptiveLimit counts errors per logical request rather than per attempt
+    """
+
+    def __init__(self, client, limit):
+        super().__init__(client)
+        self.limit = limit
+
+    def generate_samples(self, prompt, n):
+        start = time.monotonic()
+        try:
+            responses = self.client.generate_samples(prompt, n)
+        except Exception as e:
+            self.limit.record_outcome(time.monotonic() - start, e)
+            raise
+        self.limit.record_outcome(time.monotonic() - start)
+        return responses
+
+    async def agenerate_samples(self, prompt, n):
+        start = time.monotonic()
+        try:
+            responses = await self.client.agenerate_samples(prompt, n)
+        except Exception as e:
+            self.limit.record_outcome(time.monotonic() - start, e)
+            raise
+        self.limit.record_outcome(time.monotonic() - start)
+        return responses
@@ -0,0 +1,255 @@
+import logging
+import random
+import threading
+import time
+
+from utils.llm_clients import ClientWrapper
+
+"""
+endpoint_pool.py - route local LLM requests over several OpenAI-compatible replicas
+"""
+
+logger = logging.getLogger(__name__)
+
+ROUTING_STRATEGIES = ("least_outstanding", "latency")
+
+# weight of the newest observation in each endpoint's latency average
+LATENCY_SMOOTHING = 0.2
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+_health_checker = None
+
+
+class EndpointState:
+    """
+    Load, latency and health of one replica, shared by every pool in the process
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.in_flight = 0
+        self.latency = None
+        self.healthy = True
+        # when an endpoint taken out after a failed request may be tried again
+        self.retry_at = None
+        self.lock = threading.Lock()
+
+    def score(self, routing):
+        """
+        Lower is better: in-flight requests, or (for 'latency') the average
+        latency scaled by in-flight requests so one fast replica is not flooded
+        """
+        if routing == "latency":
+            return (self.latency or 0.0) * (self.in_flight + 1)
+        return self.in_flight
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+        return time.monotonic()
+
+    def finish(self, started, error=None):
+        latency = time.monotonic() - started
+        with self.lock:
+            self.in_flight -= 1
+            if error is None:
+                self.latency = (
+                    latency
+                    if self.latency is None
+                    else LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+                )
+
+    def available(self):
+        """
+        True if healthy, or out of rotation only until a cooldown that has passed
+        """
+        return self.healthy or (self.retry_at is not None and time.monotonic() >= self.retry_at)
+
+    def set_healthy(self, healthy, reason="", cooldown=None):
+        """
+        Put the endpoint in or out of rotation. Out of rotation it stays out
+        until a probe or request succeeds, or for cooldown seconds if given
+        """
+        with self.lock:
+            changed = healthy != self.healthy
+            self.healthy = healthy
+            self.retry_at = None if healthy or cooldown is None else time.monotonic() + cooldown
+        if changed and healthy:
+            logger.info(f"Endpoint {self.base_url} recovered, back in rotation")
+        elif changed:
+            logger.warning(f"Endpoint {self.base_url} unhealthy, out of rotation: {reason}")
+
+
+class HealthChecker:
+    """
+    Background thread probing every registered endpoint's /models route
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.probes = {}
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="endpoint-health", daemon=True)
+        self.thread.start()
+
+    def register(self, state, probe):
+        """
+        Add an endpoint; probe is a callable that raises if the endpoint is down
+        """
+        with self.lock:
+            self.probes.setdefault(state.base_url, (state, probe))
+
+    def check(self, state, probe):
+        try:
+            probe()
+            state.set_healthy(True)
+        except Exception as e:
+            state.set_healthy(False, f"{type(e).__name__}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                probes = list(self.probes.values())
+            for state, probe in probes:
+                self.check(state, probe)
+
+
+def get_endpoint_state(base_url):
+    with _endpoints_lock:
+        if base_url not in _endpoints:
+            _endpoints[base_url] = EndpointState(base_url)
+        return _endpoints[base_url]
+
+
+def get_health_checker(interval):
+    """
+    Return the process-wide HealthChecker, starting it on first use
+    """
+    global _health_checker
+    with _endpoints_lock:
+        if _health_checker is None:
+            _health_checker = HealthChecker(interval)
+        return _health_checker
+
+
+def is_connection_error(error):
+    """
+    True when the request never reached the server (refused, reset, DNS)
+    """
+    return isinstance(error, ConnectionError) or "connect" in type(error).__name__.lower()
+
+
+class EndpointPool(ClientWrapper):
+    """
+    Spreads requests over several LocalClients, one per replica.
+
+    Each request goes to the healthy replica with the lowest score (see
+    EndpointState.score). Replicas are taken out of rotation when a probe
+    of /models fails, and put back when a later probe succeeds. A request
+    that cannot connect takes its replica out for ejection_cooldown
+    seconds, after which it is tried again (and put back if the request
+    succeeds), so a transient blip does not remove it for good even with
+    probing disabled. If no replica is healthy, requests are still sent to
+    the least loaded one so errors surface to the retry layer.
+
+    Wraps the first replica's LocalClient, so attributes such as model come
+    from it; note that .client is that LocalClient, not an SDK client. Batch
+    mode runs against that first replica alone (see create_batch_runner).
+    """
+
+    def __init__(
+        self,
+        clients,
+        routing="least_outstanding",
+        health_check_interval=30.0,
+        ejection_cooldown=30.0,
+    ):
+        """
+        Args:
+            clients:
+                LocalClient per replica
+            routing:
+                'least_outstanding' or 'latency'
+            health_check_interval:
+                Seconds between /models probes of every replica (0 disables probing)
+            ejection_cooldown:
+                Seconds a replica is left out after a request cannot connect
+        """
+        if routing not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unknown endpoint routing strategy: {routing}")
+
+        super().__init__(clients[0])
+        self.routing = routing
+        self.ejection_cooldown = ejection_cooldown
+        self.endpoints = [(get_endpoint_state(c.base_url), c) for c in clients]
+
+        if health_check_interval:
+            checker = get_health_checker(health_check_interval)
+            for state, client in self.endpoints:
+                checker.register(state, self._probe(client))
+
+        logger.info(
+            f"Initialised EndpointPool with {len(clients)} endpoints "
+            f"(routing={routing}, health_check_interval={health_check_interval}s)"
+        )
+
+    @staticmethod
+    def _probe(client):
+        def probe():
+            client.client.with_options(timeout=5.0, max_retries=0).models.list()
+
+        return probe
+
+    def _choose(self):
+        candidates = [e for e in self.endpoints if e[0].available()] or self.endpoints
+        # shuffled so ties (e.g. every replica idle) are broken at random
+        candidates = random.sample(candidates, len(candidates))
+        return min(candidates, key=lambda e: e[0].score(self.routing))
+
+    def _call(self, method, *args):
+        state, client = self._choose()
+        started = state.start()
+        error = None
+        try:
+            response = getattr(client, method)(*args)
+        except Exception as e:
+            error = e
+            if is_connection_error(e):
+                state.set_healthy(False, f"{type(e).__name__}: {e}", self.ejection_cooldown)
+            raise
+        finally:
+            state.finish(started, error)
+        if not state.healthy:
+            state.set_healthy(True)
+        return response
+
+    async def _acall(self, method, *args):
+        state, client = self._choose()
+        started = state.start()
+        error = None
+        try:
+            response = await getattr(client, method)(*args)
+        except Exception as e:
+            error = e
+            if is_connection_error(e):
+                state.set_healthy(False, f"{type(e).__name__}: {e}", self.ejection_cooldown)
+            raise
+        finally:
+            state.finish(started, error)
+        if not state.healthy:
+            state.set_healthy(True)
+        return response
+
+    def generate(self, prompt):
+        return self._call("generate", prompt)
+
+    async def agenerate(self, prompt):
+        return await self._acall("agenerate", prompt)
+
+    def generate_samples(self, prompt, n):
+        return self._call("generate_samples", prompt, n)
+
+    async def agenerate_samples(self, prompt, n):
+        return await self._acall("agenerate_samples", prompt, n)
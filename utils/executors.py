@@ -0,0 +1,281 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+"""
+executors.py - strategies for dispatching LLM calls over a stream of jobs
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class RunDeadline:
+    """
+    Wall-clock limit for a run. No job is dispatched once it has passed;
+    calls still in flight get grace seconds to finish before they are
+    cancelled (async) or abandoned (threads).
+    """
+
+    def __init__(self, seconds, grace=0.0):
+        self.seconds = seconds
+        self.at = time.monotonic() + seconds
+        self.grace = grace
+        self.reached = False
+
+    def expired(self):
+        """
+        True (and remembered) once the deadline has passed
+        """
+        if not self.reached and time.monotonic() >= self.at:
+            self.reached = True
+            logger.warning(
+                f"Run deadline of {self.seconds:.0f}s reached, no new requests will be sent; "
+                f"finishing in-flight requests (up to {self.grace:.0f}s)"
+            )
+        return self.reached
+
+    def remaining(self):
+        """
+        Seconds until in-flight calls are cut off
+        """
+        return max(0.0, self.at + self.grace - time.monotonic())
+
+
+def deadline_error():
+    return TimeoutError("Cancelled at run deadline")
+
+
+def call_llm(llm_client, job):
+    """
+    Make the LLM call for a job: one response, or a list of responses when
+    the job asks for more than one sample
+    """
+    samples = job.get("samples", 1)
+    if samples == 1:
+        return llm_client.generate(job["prompt"])
+    return llm_client.generate_samples(job["prompt"], samples)
+
+
+async def acall_llm(llm_client, job):
+    """
+    Async version of call_llm
+    """
+    samples = job.get("samples", 1)
+    if samples == 1:
+        return await llm_client.agenerate(job["prompt"])
+    return await llm_client.agenerate_samples(job["prompt"], samples)
+
+
+def run_sequential(llm_client, jobs, on_success, on_error, deadline=None):
+    """
+    Call the LLM for each job in turn, one request at a time.
+
+    Args:
+        llm_client:
+            LLMClient used for every call
+        jobs:
+            Iterable of job dicts, each with at least 'doc_id' and 'prompt'
+        on_success:
+            Callback (job, response) invoked when a call returns; response
+            is a list when the job has 'samples' > 1
+        on_error:
+            Callback (job, exception) invoked when a call raises
+        deadline:
+            Optional RunDeadline after which no further jobs are started
+    """
+    for job in jobs:
+        if deadline is not None and deadline.expired():
+            break
+        try:
+            logger.info(f"Generating content for {job['doc_id']}")
+            response = call_llm(llm_client, job)
+            on_success(job, response)
+        except Exception as e:
+            on_error(job, e)
+
+
+def run_threaded(client_factory, jobs, on_success, on_error, max_workers=8, deadline=None):
+    """
+    Call the LLM for all jobs from a bounded thread pool.
+
+    Intended for clients that only offer a blocking generate(). Each worker
+    thread lazily creates its own client from client_factory and reuses it
+    for every job it runs. Callbacks are invoked on the calling thread in
+    completion order, so they need no locking.
+
+    Args:
+        client_factory:
+            Zero-argument callable returning a new LLMClient
+        jobs:
+            Iterable of job dicts, each with at least 'doc_id' and 'prompt'
+        on_success:
+            Callback (job, response) invoked when a call returns; response
+            is a list when the job has 'samples' > 1
+        on_error:
+            Callback (job, exception) invoked when a call raises
+        max_workers:
+            Number of worker threads (and maximum concurrent LLM requests)
+        deadline:
+            Optional RunDeadline; calls still running at its cut-off are
+            reported to on_error and left to finish in the background, on
+            daemon threads that do not delay the process exiting
+    """
+    if max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1, got {max_workers}")
+
+    local = threading.local()
+
+    def call(job):
+        if not hasattr(local, "client"):
+            local.client = client_factory()
+            logger.debug(f"Created client for worker {threading.current_thread().name}")
+        logger.info(f"Generating content for {job['doc_id']}")
+        return call_llm(local.client, job)
+
+    def work():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            future, job = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(call(job))
+            except BaseException as e:
+                future.set_exception(e)
+
+    logger.info(f"Starting threaded generation with max_workers={max_workers}")
+    jobs = iter(jobs)
+    pending = {}
+
+    def dispatch():
+        if deadline is not None and deadline.expired():
+            return
+        job = next(jobs, None)
+        if job is not None:
+            future = Future()
+            tasks.put((future, job))
+            pending[future] = job
+
+    # daemon threads rather than a ThreadPoolExecutor, whose threads are joined
+    # at exit, so calls abandoned at the deadline do not keep the process alive
+    tasks = queue.Queue()
+    threads = [
+        threading.Thread(target=work, name=f"llm-{i}", daemon=True) for i in range(max_workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        # keep the queue no deeper than the pool so prompts are built lazily
+        for _ in range(max_workers):
+            dispatch()
+
+        while pending:
+            timeout = None
+            if deadline is not None:
+                # wake at the deadline to announce it, then at the end of its grace period
+                timeout = (
+                    deadline.remaining()
+                    if deadline.expired()
+                    else deadline.at - time.monotonic()
+                )
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if not deadline.expired() or deadline.remaining() > 0:
+                    continue
+                # blocking calls cannot be interrupted; they end with their read timeout
+                for future, job in pending.items():
+                    on_error(job, deadline_error())
+                break
+
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    on_success(job, future.result())
+                except Exception as e:
+                    on_error(job, e)
+                dispatch()
+    finally:
+        # anything still pending was abandoned, or is unstarted after an error
+        for future in pending:
+            future.cancel()
+        for _ in threads:
+            tasks.put(None)
+        if not pending:
+            for thread in threads:
+                thread.join()
+
+
+def run_async(llm_client, jobs, on_success, on_error, max_in_flight=8, deadline=None):
+    """
+    Call the LLM for all jobs on an asyncio event loop.
+
+    A fixed pool of worker coroutines pulls from the shared job iterator, so
+    at most max_in_flight requests are outstanding and prompts are only built
+    as workers become free. The iterator and callbacks run on threads, so
+    they may block (e.g. on a full queue) without stalling the event loop;
+    callbacks for different jobs can run at the same time.
+
+    Args:
+        llm_client:
+            LLMClient used for every call (via agenerate)
+        jobs:
+            Iterable of job dicts, each with at least 'doc_id' and 'prompt'
+        on_success:
+            Callback (job, response) invoked when a call returns; response
+            is a list when the job has 'samples' > 1
+        on_error:
+            Callback (job, exception) invoked when a call raises
+        max_in_flight:
+            Maximum number of concurrent LLM requests
+        deadline:
+            Optional RunDeadline; calls still running at its cut-off are
+            cancelled and reported to on_error
+    """
+    asyncio.run(arun_async(llm_client, jobs, on_success, on_error, max_in_flight, deadline))
+
+
+async def arun_async(llm_client, jobs, on_success, on_error, max_in_flight=8, deadline=None):
+    """
+    Async version of run_async, for callers already running an event loop
+
+    Clients that pool connections or async locks are bound to the loop they
+    were first used on, so callers running several batches of jobs should
+    await this on one loop rather than call run_async for each.
+    """
+    if max_in_flight < 1:
+        raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+
+    jobs = iter(jobs)
+    # one worker at a time pulls from the iterator, which may not be thread safe
+    jobs_lock = asyncio.Lock()
+
+    async def worker():
+        while deadline is None or not deadline.expired():
+            async with jobs_lock:
+                job = await asyncio.to_thread(next, jobs, None)
+            if job is None:
+                return
+            try:
+                logger.info(f"Generating content for {job['doc_id']}")
+                if deadline is None:
+                    response = await acall_llm(llm_client, job)
+                else:
+                    try:
+                        response = await asyncio.wait_for(
+                            acall_llm(llm_client, job), deadline.remaining()
+                        )
+                    except asyncio.TimeoutError:
+                        if deadline.remaining() > 0:
+                            raise
+                        raise deadline_error() from None
+                await asyncio.to_thread(on_success, job, response)
+            except Exception as e:
+                await asyncio.to_thread(on_error, job, e)
+
+    logger.info(f"Starting async generation with max_in_flight={max_in_flight}")
+    await asyncio.gather(*(worker() for _ in range(max_in_flight)))
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from utils.concurrency import percentile
+from utils.llm_clients import ClientWrapper
+from utils.rate_limit import estimate_tokens
+
+"""
+hedging.py - duplicate slow LLM requests to cut tail latency
+"""
+
+logger = logging.getLogger(__name__)
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+# runs blocking calls so they can be raced; a losing blocking call cannot be
+# interrupted and finishes in the background with its result discarded
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+class HedgePolicy:
+    """
+    Recent latencies and hedge accounting for one provider.
+
+    A hedge is due once a call has run longer than the given percentile of
+    recent latencies. Hedges are capped at max_hedge_ratio of requests so a
+    provider-wide slowdown cannot double the load on it.
+
+    The extra tokens of hedging are the hedges' prompts plus the output of
+    every losing call: an abandoned blocking call runs to completion and is
+    billed in full, and a cancelled async call is estimated at the winner's
+    output.
+    """
+
+    def __init__(self, provider, pct=95, min_samples=20, window=200, max_hedge_ratio=0.1):
+        """
+        Args:
+            provider:
+                Provider name, for reporting
+            pct:
+                Latency percentile after which a hedge is sent
+            min_samples:
+                Latencies to observe before hedging starts
+            window:
+                Number of recent latencies kept
+            max_hedge_ratio:
+                Maximum hedges per request
+        """
+        self.provider = provider
+        self.pct = pct
+        self.min_samples = min_samples
+        self.max_hedge_ratio = max_hedge_ratio
+        self.latencies = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.extra_input_tokens = 0
+        self.extra_output_tokens = 0
+
+    def delay(self):
+        """
+        Seconds to wait before hedging the next request, or None to not hedge
+        """
+        with self.lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            return percentile(list(self.latencies), self.pct)
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def try_hedge(self, prompt):
+        """
+        Count a hedge against the budget; False if the budget is used up
+        """
+        with self.lock:
+            if self.hedges >= self.max_hedge_ratio * self.requests:
+                return False
+            self.hedges += 1
+            self.extra_input_tokens += estimate_tokens(prompt)
+            return True
+
+    def won(self):
+        with self.lock:
+            self.hedges_won += 1
+
+    def lost(self, responses):
+        """
+        Count the output of a losing call
+        """
+        tokens = sum(estimate_tokens(response) for response in responses)
+        with self.lock:
+            self.extra_output_tokens += tokens
+
+
+def get_hedge_policy(provider, hedging_config):
+    """
+    Return the process-wide HedgePolicy for a provider, creating it on first use.
+
+    Args:
+        provider:
+            Provider name, used as the sharing key
+        hedging_config:
+            llm.hedging section of pipeline.yml
+    """
+    with _hedgers_lock:
+        if provider not in _hedgers:
+            _hedgers[provider] = HedgePolicy(
+                provider,
+                pct=hedging_config.get("percentile", 95),
+                min_samples=hedging_config.get("min_samples", 20),
+                window=hedging_config.get("window", 200),
+                max_hedge_ratio=hedging_config.get("max_hedge_ratio", 0.1),
+            )
+        return _hedgers[provider]
+
+
+def get_hedge_executor(max_in_flight):
+    """
+    Return the process-wide pool for racing blocking calls, with room for a
+    primary and a hedge for each of max_in_flight concurrent calls.
+
+    A larger max_in_flight than the current pool allows replaces it with a
+    bigger one; calls already running on the old pool finish there.
+
+    Args:
+        max_in_flight:
+            Most LLM calls the executor runs at once
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor_workers < 2 * max_in_flight:
+            _executor_workers = 2 * max_in_flight
+            _executor = ThreadPoolExecutor(max_workers=_executor_workers, thread_name_prefix="hedge")
+        return _executor
+
+
+def hedge_policies():
+    """
+    Every HedgePolicy created so far, for end-of-run reporting
+    """
+    with _hedgers_lock:
+        return list(_hedgers.values())
+
+
+class HedgedClient(ClientWrapper):
+    """
+    Wraps any LLMClient so a call still running after the policy's delay is
+    duplicated; the first response wins and the other call is cancelled
+    (async) or abandoned (blocking). If one call fails, the other is awaited.
+    """
+
+    def __init__(self, client, policy, max_in_flight=8):
+        """
+        Args:
+            client:
+                LLMClient to hedge
+            policy:
+                HedgePolicy shared by the provider's clients
+            max_in_flight:
+                Most calls made through the client at once, to size the
+                pool that races blocking calls
+        """
+        super().__init__(client)
+        self.policy = policy
+        self.executor = get_hedge_executor(max_in_flight)
+
+    def _timed(self, prompt, n):
+        start = time.monotonic()
+        responses = self.client.generate_samples(prompt, n)
+        self.policy.record(time.monotonic() - start)
+        return responses
+
+    async def _atimed(self, prompt, n):
+        start = time.monotonic()
+        responses = await self.client.agenerate_samples(prompt, n)
+        self.policy.record(time.monotonic() - start)
+        return responses
+
+    def _settle(self, done, pending, hedge):
+        """
+        Pick the call to return once some have finished: a successful one if
+        any (the rest are then abandoned), else a failure when none remain.
+        Returns None to keep waiting.
+        """
+        succeeded = [call for call in done if call.exception() is None]
+        if not succeeded and pending:
+            return None
+
+        winner = succeeded[0] if succeeded else next(iter(done))
+        if succeeded and winner is hedge:
+            self.policy.won()
+        return winner
+
+    def generate_samples(self, prompt, n):
+        delay = self.policy.delay()
+        if delay is None:
+            return self._timed(prompt, n)
+
+        primary = self.executor.submit(self._timed, prompt, n)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.policy.try_hedge(prompt):
+            return primary.result()
+
+        logger.debug(f"Hedging {self.policy.provider} request after {delay:.1f}s")
+        hedge = self.executor.submit(self._timed, prompt, n)
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = self._settle(done, pending, hedge)
+            if winner is not None:
+                loser = hedge if winner is primary else primary
+                # counted once it finishes, as it is billed even though abandoned
+                loser.add_done_callback(self._count_loser)
+                return winner.result()
+
+    def _count_loser(self, call):
+        if not call.cancelled() and call.exception() is None:
+            self.policy.lost(call.result())
+
+    async def agenerate_samples(self, prompt, n):
+        delay = self.policy.delay()
+        if delay is None:
+            return await self._atimed(prompt, n)
+
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._atimed(prompt, n))
+        tasks = [primary]
+        winner = None
+        try:
+            done, _ = await asyncio.wait([primary], timeout=delay)
+            if done or not self.policy.try_hedge(prompt):
+                return await primary
+
+            logger.debug(f"Hedging {self.policy.provider} request after {delay:.1f}s")
+            hedge = asyncio.ensure_future(self._atimed(prompt, n))
+            tasks.append(hedge)
+            pending = set(tasks)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = self._settle(done, pending, hedge)
+                if winner is not None:
+                    return winner.result()
+        finally:
+            # the losing call is cancelled, closing its connection
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    if task is primary:
+                        # it was at least this slow; keep that in the latency history
+                        self.policy.record(time.monotonic() - started)
+                    # billed for what it generated before the cancel, estimated from the winner
+                    if winner is not None and winner.exception() is None:
+                        self.policy.lost(winner.result())
+                elif task is not winner and len(tasks) > 1:
+                    self._count_loser(task)
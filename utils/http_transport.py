@@ -0,0 +1,60 @@
+import json
+import logging
+import threading
+
+"""
+http_transport.py - shared pooled HTTP clients for the Anthropic and OpenAI SDKs
+"""
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_clients(http_config):
+    """
+    Return the process-wide (httpx.Client, httpx.AsyncClient) pair for an
+    llm.http configuration, creating it on first use.
+
+    Every SDK client built from the same configuration shares these
+    connection pools, so connections (and TLS sessions) are reused across
+    providers, replicas and worker threads instead of each client opening
+    its own.
+
+    Args:
+        http_config:
+            llm.http section of pipeline.yml, with any of max_connections,
+            max_keepalive_connections, keepalive_expiry, http2 and proxy
+    """
+    try:
+        import httpx
+    except ImportError:
+        raise ImportError("httpx package not installed. Run: pip install httpx")
+
+    http2 = http_config.get("http2", False)
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            raise ImportError("h2 package not installed for HTTP/2. Run: pip install 'httpx[http2]'")
+
+    key = json.dumps(http_config, sort_keys=True)
+    with _clients_lock:
+        if key not in _clients:
+            options = {
+                "limits": httpx.Limits(
+                    max_connections=http_config.get("max_connections", 100),
+                    max_keepalive_connections=http_config.get("max_keepalive_connections", 20),
+                    keepalive_expiry=http_config.get("keepalive_expiry", 5.0),
+                ),
+                "http2": http2,
+                # the SDKs follow redirects on their default clients too
+                "follow_redirects": True,
+            }
+            if http_config.get("proxy"):
+                options["proxy"] = http_config["proxy"]
+
+            _clients[key] = (httpx.Client(**options), httpx.AsyncClient(**options))
+            logger.info(f"Initialised shared HTTP transport with {http_config}")
+        return _clients[key]
@@ -1,7 +1,12 @@
+import asyncio
 import logging
 import os
+import threading
 from abc import ABC, abstractmethod
-from typing import Optional
+from concurrent.futures import Future
+from typing import List, Optional
+
+from utils.parse_output import OUTPUT_CLOSE_TAG, OutputStream, close_unterminated_output
 
 """
 llm_clients.py - LLM client abstractions for calling different API providers.
@@ -9,12 +14,45 @@ llm_clients.py - LLM client abstractions for calling different API providers.
 
 logger = logging.getLogger(__name__)
 
+# in-process llama.cpp models, one per model file
+_llama_workers = {}
+_llama_workers_lock = threading.Lock()
+
+
+class Response(str):
+    """
+    Response text that records the provider and model that produced it
+    """
+
+    def __new__(cls, text, provider=None, model=None):
+        response = super().__new__(cls, text)
+        response.provider = provider
+        response.model = model
+        return response
+
+
+def tag_responses(responses: List[str], client: "LLMClient") -> List[Response]:
+    """
+    Mark responses with the provider and model of the client that returned them
+    """
+    model = client.generation_params()["model"]
+    return [Response(response, client.provider, model) for response in responses]
+
 
 class LLMClient(ABC):
     """
     Abstract base class for any clients
     """
 
+    # provider name as used in pipeline.yml
+    provider = None
+
+    # True when generate_samples returns n responses from a single request
+    native_samples = False
+
+    # finish reason the API reports when generation ended on a stop sequence
+    stop_finish_reason = "stop"
+
     @abstractmethod
     def generate(self, prompt: str) -> str:
         """
@@ -29,13 +67,184 @@ class LLMClient(ABC):
         """
         pass
 
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Generate a response from the LLM without blocking the event loop.
+
+        Clients with an async SDK override this; the default runs the
+        blocking generate() in a worker thread.
+
+        Args:
+            prompt:
+                Prompt to send to the LLM
+
+        Returns:
+            Raw response text from the LLM
+        """
+        return await asyncio.to_thread(self.generate, prompt)
+
+    def generate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Generate n independent responses to the same prompt.
+
+        Clients whose API can return several completions per request override
+        this; the default makes n separate calls.
+
+        Args:
+            prompt:
+                Prompt to send to the LLM
+            n:
+                Number of responses
+
+        Returns:
+            List of raw response texts
+        """
+        return [self.generate(prompt) for _ in range(n)]
+
+    async def agenerate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Async version of generate_samples; the default makes n concurrent calls.
+        """
+        return list(await asyncio.gather(*(self.agenerate(prompt) for _ in range(n))))
+
+    def restore_stop_sequence(self, text: str, finish_reason) -> str:
+        """
+        Close a trailing <OUTPUT> when generation ended on a stop sequence
+        rather than at max tokens, as the provider drops the matched sequence.
+        """
+        reason = getattr(finish_reason, "name", finish_reason)
+        if self.stop_sequences and reason == self.stop_finish_reason:
+            return close_unterminated_output(text)
+        return text
+
+    @staticmethod
+    def feed_stream(output: OutputStream, text: Optional[str], finish_reason=None) -> bool:
+        """
+        Add a streamed chunk's text and finish reason to the output; True once
+        the output is complete.
+        """
+        if finish_reason:
+            output.finish_reason = finish_reason
+        if not text:
+            return False
+        return output.feed(text)
+
+    def generation_params(self) -> dict:
+        """
+        Settings that determine the response to a prompt (used to key cached responses).
+        """
+        return {
+            "provider": self.provider,
+            "model": getattr(self, "model_name", None) or self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stop_sequences": self.stop_sequences,
+        }
+
+
+class ClientWrapper(LLMClient):
+    """
+    Base class for clients that add behaviour around another LLMClient.
+
+    Subclasses override generate_samples/agenerate_samples; single responses
+    are routed through them with n=1 so every call path gets the behaviour.
+    Unknown attributes (model, max_tokens, ...) are read from the wrapped client.
+    """
+
+    def __init__(self, client: LLMClient):
+        self.client = client
+
+    @property
+    def provider(self):
+        return self.client.provider
+
+    @property
+    def native_samples(self):
+        return self.client.native_samples
+
+    def generation_params(self) -> dict:
+        return self.client.generation_params()
+
+    def generate(self, prompt: str) -> str:
+        return self.generate_samples(prompt, 1)[0]
+
+    async def agenerate(self, prompt: str) -> str:
+        return (await self.agenerate_samples(prompt, 1))[0]
+
+    def generate_samples(self, prompt: str, n: int) -> List[str]:
+        return self.client.generate_samples(prompt, n)
+
+    async def agenerate_samples(self, prompt: str, n: int) -> List[str]:
+        return await self.client.agenerate_samples(prompt, n)
+
+    def __getattr__(self, name):
+        if name == "client":
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+
+def error_status_code(error: Exception) -> Optional[int]:
+    """
+    Best-effort HTTP status code for an exception raised by any provider SDK.
+
+    Anthropic and OpenAI errors carry status_code; google.api_core errors
+    carry an integer code.
+    """
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Read a Retry-After header (in seconds) from an SDK error, if present
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def sdk_timeout_options(
+    connect_timeout: Optional[float], read_timeout: Optional[float]
+) -> dict:
+    """
+    timeout argument for the Anthropic/OpenAI SDK constructors; empty keeps
+    the SDK default. A None component means no limit for that phase.
+    """
+    if connect_timeout is None and read_timeout is None:
+        return {}
+    import httpx
+
+    return {"timeout": httpx.Timeout(read_timeout, connect=connect_timeout)}
+
 
 class GeminiClient(LLMClient):
     """
     Client for Google Gemini API
     """
 
-    def __init__(self, model: str, temperature: float = 1.0, max_tokens: int = 4000):
+    provider = "gemini"
+    native_samples = True
+    stop_finish_reason = "STOP"
+
+    def __init__(
+        self,
+        model: str,
+        temperature: float = 1.0,
+        max_tokens: int = 4000,
+        stream: bool = False,
+        stop_sequences: Optional[List[str]] = None,
+        outputs_per_response: int = 1,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+    ):
         """
         Initialise Gemini client.
 
@@ -46,6 +255,18 @@ class GeminiClient(LLMClient):
                 Sampling temperature
             max_tokens:
                 Max tokens to generate
+            stream:
+                Stream the response and stop reading once the expected
+                </OUTPUT> tags have been received
+            stop_sequences:
+                Optional stop sequences passed to the API
+            outputs_per_response:
+                Number of </OUTPUT> tags that complete a streamed response
+            connect_timeout:
+                Seconds allowed to connect; the Gemini SDK has a single
+                deadline per call, so this is added to read_timeout
+            read_timeout:
+                Seconds allowed for the response
         """
         try:
             import google.generativeai as genai
@@ -65,7 +286,29 @@ class GeminiClient(LLMClient):
         self.model_name = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.stream = stream
+        self.stop_sequences = stop_sequences
+        self.outputs_per_response = outputs_per_response
         self.model = self.genai.GenerativeModel(model)
+        self.generation_config = {
+            "temperature": temperature,
+            "max_output_tokens": max_tokens,
+        }
+        if stop_sequences:
+            self.generation_config["stop_sequences"] = stop_sequences
+        self.request_options = {}
+        if read_timeout is not None:
+            self.request_options["timeout"] = read_timeout + (connect_timeout or 0)
+
+        # Disable all safety filters to allow medical/technical content generation
+        harm = self.genai.types.HarmCategory
+        block_none = self.genai.types.HarmBlockThreshold.BLOCK_NONE
+        self.safety_settings = [
+            {"category": harm.HARM_CATEGORY_HARASSMENT, "threshold": block_none},
+            {"category": harm.HARM_CATEGORY_HATE_SPEECH, "threshold": block_none},
+            {"category": harm.HARM_CATEGORY_SEXUALLY_EXPLICIT, "threshold": block_none},
+            {"category": harm.HARM_CATEGORY_DANGEROUS_CONTENT, "threshold": block_none},
+        ]
 
         logger.info(
             f"Initialized GeminiClient with model={model}, temperature={temperature}, max_tokens={max_tokens}"
@@ -78,48 +321,56 @@ class GeminiClient(LLMClient):
         logger.debug(f"Sending prompt to Gemini (length={len(prompt)} chars)")
 
         try:
-            # Disable all safety filters to allow medical/technical content generation
-            safety_settings = [
-                {
-                    "category": self.genai.types.HarmCategory.HARM_CATEGORY_HARASSMENT,
-                    "threshold": self.genai.types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": self.genai.types.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                    "threshold": self.genai.types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": self.genai.types.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                    "threshold": self.genai.types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": self.genai.types.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                    "threshold": self.genai.types.HarmBlockThreshold.BLOCK_NONE,
-                },
-            ]
-
             response = self.model.generate_content(
                 prompt,
-                generation_config={
-                    "temperature": self.temperature,
-                    "max_output_tokens": self.max_tokens,
-                },
-                safety_settings=safety_settings,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings,
+                stream=self.stream,
+                request_options=self.request_options,
             )
+            if self.stream:
+                output = OutputStream(self.outputs_per_response)
+                try:
+                    for chunk in response:
+                        if self._feed_chunk(output, chunk):
+                            break
+                finally:
+                    self._close_stream(response)
+                result = self._finish_stream(output)
+            else:
+                result = self._extract_text(response)
+            logger.debug(f"Received response from Gemini (length={len(result)} chars)")
+            return result
 
-            # Check if response was blocked by safety filters
-            if not response.parts:
-                finish_reason = (
-                    response.candidates[0].finish_reason
-                    if response.candidates
-                    else None
-                )
-                logger.error(f"Gemini blocked response. Finish reason: {finish_reason}")
-                raise ValueError(
-                    f"Response blocked by Gemini. Finish reason: {finish_reason}"
-                )
+        except Exception as e:
+            logger.error(f"Error generating from Gemini: {e}")
+            raise
 
-            result = response.text
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Generate response from Gemini using the async API.
+        """
+        logger.debug(f"Sending async prompt to Gemini (length={len(prompt)} chars)")
+
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self.generation_config,
+                safety_settings=self.safety_settings,
+                stream=self.stream,
+                request_options=self.request_options,
+            )
+            if self.stream:
+                output = OutputStream(self.outputs_per_response)
+                try:
+                    async for chunk in response:
+                        if self._feed_chunk(output, chunk):
+                            break
+                finally:
+                    self._close_stream(response)
+                result = self._finish_stream(output)
+            else:
+                result = self._extract_text(response)
             logger.debug(f"Received response from Gemini (length={len(result)} chars)")
             return result
 
@@ -127,13 +378,144 @@ class GeminiClient(LLMClient):
             logger.error(f"Error generating from Gemini: {e}")
             raise
 
+    def generate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Generate n responses from Gemini in one request using candidate_count.
+        """
+        if n == 1:
+            return [self.generate(prompt)]
+
+        logger.debug(f"Sending prompt to Gemini for {n} candidates (length={len(prompt)} chars)")
+
+        try:
+            response = self.model.generate_content(
+                prompt,
+                generation_config={**self.generation_config, "candidate_count": n},
+                safety_settings=self.safety_settings,
+                request_options=self.request_options,
+            )
+            return self._extract_candidates(response, n)
+
+        except Exception as e:
+            logger.error(f"Error generating from Gemini: {e}")
+            raise
+
+    async def agenerate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Async version of generate_samples using candidate_count.
+        """
+        if n == 1:
+            return [await self.agenerate(prompt)]
+
+        logger.debug(f"Sending async prompt to Gemini for {n} candidates (length={len(prompt)} chars)")
+
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config={**self.generation_config, "candidate_count": n},
+                safety_settings=self.safety_settings,
+                request_options=self.request_options,
+            )
+            return self._extract_candidates(response, n)
+
+        except Exception as e:
+            logger.error(f"Error generating from Gemini: {e}")
+            raise
+
+    @staticmethod
+    def _close_stream(response):
+        """
+        Cancel a streamed response so an early stop ends generation too.
+
+        The SDK's response has no close(); the gRPC or REST stream underneath
+        it has cancel(), which is a no-op once the stream has finished.
+        """
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if cancel is not None:
+            cancel()
+
+    def _feed_chunk(self, output: OutputStream, chunk) -> bool:
+        return self.feed_stream(
+            output,
+            chunk.text if chunk.parts else None,
+            chunk.candidates[0].finish_reason if chunk.candidates else None,
+        )
+
+    def _finish_stream(self, output: OutputStream) -> str:
+        """
+        Return streamed text, raising if nothing was produced.
+        """
+        if output.complete:
+            logger.debug("Stopped reading Gemini stream at end of output")
+            return output.text
+        if not output.text:
+            logger.error(f"Gemini blocked response. Finish reason: {output.finish_reason}")
+            raise ValueError(
+                f"Response blocked by Gemini. Finish reason: {output.finish_reason}"
+            )
+        return self.restore_stop_sequence(output.text, output.finish_reason)
+
+    def _extract_candidates(self, response, n: int) -> List[str]:
+        """
+        Return the text of every candidate not blocked by safety filters.
+        """
+        results = [
+            self.restore_stop_sequence(
+                "".join(part.text for part in candidate.content.parts),
+                candidate.finish_reason,
+            )
+            for candidate in response.candidates
+            if candidate.content.parts
+        ]
+        if not results:
+            # raises with the finish reason
+            self._extract_text(response)
+        if len(results) < n:
+            logger.warning(f"Gemini returned {len(results)} of {n} requested candidates")
+
+        logger.debug(f"Received {len(results)} candidates from Gemini")
+        return results
+
+    def _extract_text(self, response) -> str:
+        """
+        Return response text, raising if it was blocked by safety filters.
+        """
+        if not response.parts:
+            finish_reason = (
+                response.candidates[0].finish_reason
+                if response.candidates
+                else None
+            )
+            logger.error(f"Gemini blocked response. Finish reason: {finish_reason}")
+            raise ValueError(
+                f"Response blocked by Gemini. Finish reason: {finish_reason}"
+            )
+
+        return self.restore_stop_sequence(response.text, response.candidates[0].finish_reason)
+
 
 class ClaudeClient(LLMClient):
     """
     Client for Anthropic Claude API
     """
 
-    def __init__(self, model: str, temperature: float = 1.0, max_tokens: int = 4000):
+    provider = "claude"
+
+    def __init__(
+        self,
+        model: str,
+        temperature: float = 1.0,
+        max_tokens: int = 4000,
+        base_url: Optional[str] = None,
+        prompt_caching: bool = True,
+        stream: bool = False,
+        stop_sequences: Optional[List[str]] = None,
+        outputs_per_response: int = 1,
+        max_retries: int = 2,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        http_clients: Optional[tuple] = None,
+    ):
         """
         Initialize Claude client.
 
@@ -144,9 +526,30 @@ class ClaudeClient(LLMClient):
                 Sampling temperature
             max_tokens:
                 Max tokens to generate
+            base_url:
+                Optional API base URL (e.g. a local stand-in for testing)
+            prompt_caching:
+                Mark the static prompt prefix with cache_control
+            stream:
+                Stream the response and stop reading once the expected
+                </OUTPUT> tags have been received
+            stop_sequences:
+                Optional stop sequences passed to the API
+            outputs_per_response:
+                Number of </OUTPUT> tags that complete a streamed response
+            max_retries:
+                Retries made inside the SDK (0 when the retry layer is used)
+            connect_timeout:
+                Seconds allowed to connect (None keeps the SDK default)
+            read_timeout:
+                Seconds allowed between bytes of the response (None keeps
+                the SDK default)
+            http_clients:
+                Optional shared (httpx.Client, httpx.AsyncClient) pair from
+                get_http_clients; None lets the SDK create its own pools
         """
         try:
-            from anthropic import Anthropic
+            from anthropic import Anthropic, AsyncAnthropic
         except ImportError:
             raise ImportError(
                 "anthropic package not installed. Run: pip install anthropic"
@@ -156,10 +559,22 @@ class ClaudeClient(LLMClient):
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY not found in environment variables")
 
-        self.client = Anthropic(api_key=api_key)
+        sdk_options = {
+            "api_key": api_key,
+            "base_url": base_url,
+            "max_retries": max_retries,
+            **sdk_timeout_options(connect_timeout, read_timeout),
+        }
+        http_client, async_http_client = http_clients or (None, None)
+        self.client = Anthropic(**sdk_options, http_client=http_client)
+        self.async_client = AsyncAnthropic(**sdk_options, http_client=async_http_client)
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.prompt_caching = prompt_caching
+        self.stream = stream
+        self.stop_sequences = stop_sequences
+        self.outputs_per_response = outputs_per_response
 
         logger.info(
             f"Initialized ClaudeClient with model={model}, temperature={temperature}, max_tokens={max_tokens}"
@@ -172,14 +587,100 @@ class ClaudeClient(LLMClient):
         logger.debug(f"Sending prompt to Claude (length={len(prompt)} chars)")
 
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=self.max_tokens,
-                temperature=self.temperature,
-                messages=[{"role": "user", "content": prompt}],
-            )
+            if self.stream:
+                result = self._generate_stream(prompt)
+            else:
+                response = self.client.messages.create(**self.message_params(prompt))
+                result = self.response_text(response)
+            logger.debug(f"Received response from Claude (length={len(result)} chars)")
+            return result
+
+        except Exception as e:
+            logger.error(f"Error generating from Claude: {e}")
+            raise
+
+    def message_params(self, prompt: str) -> dict:
+        """
+        Messages API parameters for a prompt, shared by direct and batch calls.
+
+        Prompts from PromptBuilder carry prefix_length; with prompt caching on,
+        that static prefix is sent as its own block marked with cache_control.
+        """
+        content = prompt
+        prefix_length = getattr(prompt, "prefix_length", 0)
+        if self.prompt_caching and 0 < prefix_length < len(prompt):
+            content = [
+                {
+                    "type": "text",
+                    "text": prompt[:prefix_length],
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {"type": "text", "text": prompt[prefix_length:]},
+            ]
+
+        params = {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if self.stop_sequences:
+            params["stop_sequences"] = self.stop_sequences
+        return params
+
+    def response_text(self, response) -> str:
+        """
+        Response text with the matched stop sequence (which Claude omits) restored.
+        """
+        result = response.content[0].text
+        if response.stop_reason == "stop_sequence" and response.stop_sequence:
+            result += response.stop_sequence
+        return result
+
+    def _generate_stream(self, prompt: str) -> str:
+        """
+        Stream a response, closing the stream as soon as the output is complete.
+        """
+        output = OutputStream(self.outputs_per_response)
+        with self.client.messages.stream(**self.message_params(prompt)) as stream:
+            for text in stream.text_stream:
+                if output.feed(text):
+                    logger.debug("Stopped reading Claude stream at end of output")
+                    return output.text
+            final = stream.get_final_message()
 
-            result = response.content[0].text
+        if final.stop_reason == "stop_sequence" and final.stop_sequence:
+            output.feed(final.stop_sequence)
+        return output.text
+
+    async def _agenerate_stream(self, prompt: str) -> str:
+        """
+        Async version of _generate_stream.
+        """
+        output = OutputStream(self.outputs_per_response)
+        async with self.async_client.messages.stream(**self.message_params(prompt)) as stream:
+            async for text in stream.text_stream:
+                if output.feed(text):
+                    logger.debug("Stopped reading Claude stream at end of output")
+                    return output.text
+            final = await stream.get_final_message()
+
+        if final.stop_reason == "stop_sequence" and final.stop_sequence:
+            output.feed(final.stop_sequence)
+        return output.text
+
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Generate response from Claude using the async SDK client.
+        """
+        logger.debug(f"Sending async prompt to Claude (length={len(prompt)} chars)")
+
+        try:
+            if self.stream:
+                result = await self._agenerate_stream(prompt)
+            else:
+                response = await self.async_client.messages.create(**self.message_params(prompt))
+                result = self.response_text(response)
             logger.debug(f"Received response from Claude (length={len(result)} chars)")
             return result
 
@@ -193,12 +694,22 @@ class LocalClient(LLMClient):
     Client for local OpenAI-compatible endpoint
     """
 
+    provider = "local"
+    native_samples = True
+
     def __init__(
         self,
         base_url: str,
         model: str,
         temperature: float = 1.0,
         max_tokens: int = 4000,
+        stream: bool = False,
+        stop_sequences: Optional[List[str]] = None,
+        outputs_per_response: int = 1,
+        max_retries: int = 2,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+        http_clients: Optional[tuple] = None,
     ):
         """
         Initialize local OpenAI-compatible client.
@@ -212,9 +723,26 @@ class LocalClient(LLMClient):
                 Sampling temperature
             max_tokens:
                 Max tokens to generate
+            stream:
+                Stream the response and stop reading once the expected
+                </OUTPUT> tags have been received
+            stop_sequences:
+                Optional stop sequences passed to the API
+            outputs_per_response:
+                Number of </OUTPUT> tags that complete a streamed response
+            max_retries:
+                Retries made inside the SDK (0 when the retry layer is used)
+            connect_timeout:
+                Seconds allowed to connect (None keeps the SDK default)
+            read_timeout:
+                Seconds allowed between bytes of the response (None keeps
+                the SDK default)
+            http_clients:
+                Optional shared (httpx.Client, httpx.AsyncClient) pair from
+                get_http_clients; None lets the SDK create its own pools
         """
         try:
-            from openai import OpenAI
+            from openai import AsyncOpenAI, OpenAI
         except ImportError:
             raise ImportError("openai package not installed. Run: pip install openai")
 
@@ -222,12 +750,20 @@ class LocalClient(LLMClient):
         self.model = model
         self.temperature = temperature
         self.max_tokens = max_tokens
+        self.stream = stream
+        self.stop_sequences = stop_sequences
+        self.outputs_per_response = outputs_per_response
 
         # Initialize OpenAI client with local endpoint (API key not required)
-        self.client = OpenAI(
-            base_url=base_url,
-            api_key="not-needed",
-        )
+        sdk_options = {
+            "base_url": base_url,
+            "api_key": "not-needed",
+            "max_retries": max_retries,
+            **sdk_timeout_options(connect_timeout, read_timeout),
+        }
+        http_client, async_http_client = http_clients or (None, None)
+        self.client = OpenAI(**sdk_options, http_client=http_client)
+        self.async_client = AsyncOpenAI(**sdk_options, http_client=async_http_client)
 
         logger.info(
             f"Initialised LocalClient with base_url={base_url}, model={model}, temperature={temperature}, max_tokens={max_tokens}"
@@ -239,15 +775,138 @@ class LocalClient(LLMClient):
         """
         logger.debug(f"Sending prompt to local API (length={len(prompt)} chars)")
 
+        try:
+            if self.stream:
+                result = self._generate_stream(prompt)
+            else:
+                response = self.client.chat.completions.create(
+                    **self.completion_params(prompt)
+                )
+                result = self._choice_text(response.choices[0])
+            logger.debug(
+                f"Received response from local API (length={len(result)} chars)"
+            )
+            return result
+
+        except Exception as e:
+            logger.error(f"Error generating from local API: {e}")
+            raise
+
+    def generate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Generate n completions from local API in one request using the n parameter.
+        """
+        if n == 1:
+            return [self.generate(prompt)]
+
+        logger.debug(f"Sending prompt to local API for {n} completions (length={len(prompt)} chars)")
+
         try:
             response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
+                **self.completion_params(prompt), n=n
             )
 
-            result = response.choices[0].message.content
+            results = [self._choice_text(choice) for choice in response.choices]
+            logger.debug(f"Received {len(results)} completions from local API")
+            return results
+
+        except Exception as e:
+            logger.error(f"Error generating from local API: {e}")
+            raise
+
+    async def agenerate_samples(self, prompt: str, n: int) -> List[str]:
+        """
+        Async version of generate_samples using the n parameter.
+        """
+        if n == 1:
+            return [await self.agenerate(prompt)]
+
+        logger.debug(f"Sending async prompt to local API for {n} completions (length={len(prompt)} chars)")
+
+        try:
+            response = await self.async_client.chat.completions.create(
+                **self.completion_params(prompt), n=n
+            )
+
+            results = [self._choice_text(choice) for choice in response.choices]
+            logger.debug(f"Received {len(results)} completions from local API")
+            return results
+
+        except Exception as e:
+            logger.error(f"Error generating from local API: {e}")
+            raise
+
+    def completion_params(self, prompt: str) -> dict:
+        """
+        Chat completions parameters for a prompt, shared by direct and batch calls.
+        """
+        params = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+        }
+        if self.stop_sequences:
+            params["stop"] = self.stop_sequences
+        return params
+
+    def _choice_text(self, choice) -> str:
+        return self.restore_stop_sequence(choice.message.content, choice.finish_reason)
+
+    def _generate_stream(self, prompt: str) -> str:
+        """
+        Stream a response, closing the stream as soon as the output is complete.
+        """
+        output = OutputStream(self.outputs_per_response)
+        stream = self.client.chat.completions.create(
+            **self.completion_params(prompt), stream=True
+        )
+        try:
+            for chunk in stream:
+                if self._feed_chunk(output, chunk):
+                    logger.debug("Stopped reading local API stream at end of output")
+                    return output.text
+        finally:
+            stream.close()
+        return self.restore_stop_sequence(output.text, output.finish_reason)
+
+    async def _agenerate_stream(self, prompt: str) -> str:
+        """
+        Async version of _generate_stream.
+        """
+        output = OutputStream(self.outputs_per_response)
+        stream = await self.async_client.chat.completions.create(
+            **self.completion_params(prompt), stream=True
+        )
+        try:
+            async for chunk in stream:
+                if self._feed_chunk(output, chunk):
+                    logger.debug("Stopped reading local API stream at end of output")
+                    return output.text
+        finally:
+            await stream.close()
+        return self.restore_stop_sequence(output.text, output.finish_reason)
+
+    def _feed_chunk(self, output: OutputStream, chunk) -> bool:
+        if not chunk.choices:
+            return False
+        choice = chunk.choices[0]
+        return self.feed_stream(output, choice.delta.content, choice.finish_reason)
+
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Generate response from local API using the async SDK client.
+        """
+        logger.debug(f"Sending async prompt to local API (length={len(prompt)} chars)")
+
+        try:
+            if self.stream:
+                result = await self._agenerate_stream(prompt)
+            else:
+                response = await self.async_client.chat.completions.create(
+                    **self.completion_params(prompt)
+                )
+                result = self._choice_text(response.choices[0])
             logger.debug(
                 f"Received response from local API (length={len(result)} chars)"
             )
@@ -258,13 +917,222 @@ class LocalClient(LLMClient):
             raise
 
 
-def create_llm_client(llm_config: dict) -> Optional[LLMClient]:
+class LlamaCppWorker:
+    """
+    Owns one in-process llama.cpp model and serves queued requests on a
+    single thread (the model is not thread-safe and already uses every
+    core for each forward pass).
+
+    llama.cpp keeps the KV cache of the previous evaluation and only
+    evaluates the tokens after the longest common prefix, so the worker
+    serves queued requests that share the current prompt prefix (template
+    plus structure instructions) before switching to another; a RAM cache
+    of KV states lets it return to earlier prefixes cheaply.
+    """
+
+    def __init__(self, model_path, n_ctx=8192, n_threads=None, n_batch=512, prefix_cache_mb=2048):
+        try:
+            from llama_cpp import Llama, LlamaRAMCache
+        except ImportError:
+            raise ImportError(
+                "llama-cpp-python package not installed. Run: pip install llama-cpp-python"
+            )
+
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_batch=n_batch,
+            verbose=False,
+        )
+        if prefix_cache_mb:
+            self.llm.set_cache(LlamaRAMCache(capacity_bytes=prefix_cache_mb * 1024 * 1024))
+
+        self.pending = []
+        self.current_prefix = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="llama-cpp", daemon=True)
+        self.thread.start()
+
+        logger.info(
+            f"Loaded llama.cpp model {model_path} (n_ctx={n_ctx}, n_threads={n_threads}, n_batch={n_batch})"
+        )
+
+    def submit(self, prompt, complete):
+        """
+        Queue complete(llm, prompt) to run on the model thread and return its Future
+        """
+        future = Future()
+        prefix = prompt[: getattr(prompt, "prefix_length", 0)]
+        with self.condition:
+            self.pending.append((prefix, prompt, complete, future))
+            self.condition.notify()
+        return future
+
+    def _next_request(self):
+        # prefer a request whose prefix is already in the KV cache
+        for i, request in enumerate(self.pending):
+            if request[0] and request[0] == self.current_prefix:
+                return self.pending.pop(i)
+        return self.pending.pop(0)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending)
+                prefix, prompt, complete, future = self._next_request()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.current_prefix = prefix
+            try:
+                future.set_result(complete(self.llm, prompt))
+            except Exception as e:
+                future.set_exception(e)
+
+
+def get_llama_worker(model_path, **options):
+    """
+    Return the process-wide LlamaCppWorker for a model file, loading it on first use
+    """
+    with _llama_workers_lock:
+        if model_path not in _llama_workers:
+            _llama_workers[model_path] = LlamaCppWorker(model_path, **options)
+        return _llama_workers[model_path]
+
+
+class LlamaCppClient(LLMClient):
+    """
+    Client for a GGUF model run in-process with llama.cpp (no server or GPU needed)
+    """
+
+    provider = "llamacpp"
+
+    def __init__(
+        self,
+        model_path: str,
+        temperature: float = 1.0,
+        max_tokens: int = 4000,
+        n_ctx: int = 8192,
+        n_threads: Optional[int] = None,
+        n_batch: int = 512,
+        prefix_cache_mb: int = 2048,
+        stream: bool = False,
+        stop_sequences: Optional[List[str]] = None,
+        outputs_per_response: int = 1,
+    ):
+        """
+        Initialise llama.cpp client.
+
+        Args:
+            model_path:
+                Path to a GGUF model file
+            temperature:
+                Sampling temperature
+            max_tokens:
+                Max tokens to generate
+            n_ctx:
+                Context window in tokens (prompt plus output)
+            n_threads:
+                CPU threads per forward pass (None uses llama.cpp's default)
+            n_batch:
+                Prompt tokens evaluated per forward pass
+            prefix_cache_mb:
+                Size of the RAM cache of prompt-prefix KV states (0 disables it)
+            stream:
+                Generate token by token and stop once the expected </OUTPUT>
+                tags have been produced
+            stop_sequences:
+                Optional stop sequences
+            outputs_per_response:
+                Number of </OUTPUT> tags that complete a streamed response
+        """
+        self.worker = get_llama_worker(
+            model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_batch=n_batch,
+            prefix_cache_mb=prefix_cache_mb,
+        )
+        self.model = os.path.basename(model_path)
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stream = stream
+        self.stop_sequences = stop_sequences
+        self.outputs_per_response = outputs_per_response
+
+        logger.info(
+            f"Initialised LlamaCppClient with model={self.model}, temperature={temperature}, max_tokens={max_tokens}"
+        )
+
+    def generate(self, prompt: str) -> str:
+        """
+        Generate response from the in-process model.
+        """
+        logger.debug(f"Queueing prompt for llama.cpp (length={len(prompt)} chars)")
+        result = self.worker.submit(prompt, self._complete).result()
+        logger.debug(f"Received response from llama.cpp (length={len(result)} chars)")
+        return result
+
+    async def agenerate(self, prompt: str) -> str:
+        """
+        Queue the prompt on the model thread without blocking the event loop.
+        """
+        logger.debug(f"Queueing async prompt for llama.cpp (length={len(prompt)} chars)")
+        result = await asyncio.wrap_future(self.worker.submit(prompt, self._complete))
+        logger.debug(f"Received response from llama.cpp (length={len(result)} chars)")
+        return result
+
+    def _complete(self, llm, prompt: str) -> str:
+        """
+        Run one chat completion; called on the worker's model thread.
+        """
+        params = {
+            "messages": [{"role": "user", "content": str(prompt)}],
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stop": self.stop_sequences,
+        }
+        if not self.stream:
+            choice = llm.create_chat_completion(**params)["choices"][0]
+            return self.restore_stop_sequence(choice["message"]["content"], choice["finish_reason"])
+
+        output = OutputStream(self.outputs_per_response)
+        stream = llm.create_chat_completion(**params, stream=True)
+        try:
+            for chunk in stream:
+                choice = chunk["choices"][0]
+                if self.feed_stream(
+                    output, choice["delta"].get("content"), choice.get("finish_reason")
+                ):
+                    logger.debug("Stopped llama.cpp generation at end of output")
+                    return output.text
+        finally:
+            stream.close()
+        return self.restore_stop_sequence(output.text, output.finish_reason)
+
+
+def create_llm_client(
+    llm_config: dict,
+    concurrency_config: Optional[dict] = None,
+    outputs_per_response: int = 1,
+) -> Optional[LLMClient]:
     """
     Factory function to create the appropriate LLM client based on config.
 
+    Each provider is set up by create_provider_stack. With
+    llm.load_balancing enabled, requests are spread over the providers in
+    its weights; otherwise llm.provider is used. With a fallback, load
+    balancing or llm.circuit_breaker enabled, requests are routed through
+    per-provider circuit breakers.
+
     Args:
         llm_config:
             Dictionary containing LLM configuration from pipeline.yml
+        concurrency_config:
+            Optional concurrency section from pipeline.yml
+        outputs_per_response:
+            Number of <OUTPUT> documents expected in each response
 
     Returns:
         LLMClient instance or None if disabled
@@ -280,12 +1148,194 @@ def create_llm_client(llm_config: dict) -> Optional[LLMClient]:
         logger.info("LLM provider set to 'none'")
         return None
 
-    elif provider == "gemini":
+    fallback = llm_config.get("fallback")
+    breaker_config = llm_config.get("circuit_breaker") or {}
+    balancing_config = llm_config.get("load_balancing") or {}
+
+    def route(name):
+        from utils.circuit_breaker import get_circuit_breaker
+
+        stack = create_provider_stack(name, llm_config, concurrency_config, outputs_per_response)
+        return get_circuit_breaker(name, breaker_config), stack
+
+    if balancing_config.get("enabled", False):
+        from utils.load_balancer import LoadBalancedClient
+
+        weights = balancing_config.get("weights") or {}
+        if not weights:
+            raise ValueError("load_balancing is enabled but no provider weights are configured")
+        if fallback in weights:
+            raise ValueError(f"Fallback provider {fallback} is also load balanced")
+
+        logger.info(f"Load balancing across {weights} ({balancing_config.get('strategy')})")
+        return LoadBalancedClient(
+            [route(name) for name in weights],
+            list(weights.values()),
+            strategy=balancing_config.get("strategy", "least_outstanding"),
+            fallback_routes=[route(fallback)] if fallback else None,
+        )
+
+    if fallback or breaker_config.get("enabled", False):
+        from utils.circuit_breaker import FailoverClient
+
+        routes = [route(provider)]
+        if fallback:
+            if fallback == provider:
+                raise ValueError(f"Fallback provider must differ from provider: {fallback}")
+            routes.append(route(fallback))
+            logger.info(f"Failing over from {provider} to {fallback} when its circuit is open")
+        return FailoverClient(routes)
+
+    return create_provider_stack(provider, llm_config, concurrency_config, outputs_per_response)
+
+
+def create_provider_stack(
+    provider: str,
+    llm_config: dict,
+    concurrency_config: Optional[dict] = None,
+    outputs_per_response: int = 1,
+) -> LLMClient:
+    """
+    Create a provider client with its configured wrappers.
+
+    The provider client is wrapped with an adaptive concurrency limit when
+    concurrency.adaptive is enabled (which sees errors outside the retry
+    layer, once per request), with a rate limiter when the
+    provider's config has a rate_limits section, with retries when
+    llm.retry.max_attempts > 1, with request hedging when llm.hedging is
+    enabled, and finally with the response cache when llm.cache.mode is
+    not 'off'.
+
+    Args:
+        provider:
+            Provider name ('gemini', 'claude', 'local', 'llamacpp', 'mock' or 'replay')
+        llm_config:
+            Dictionary containing LLM configuration from pipeline.yml
+        concurrency_config:
+            Optional concurrency section from pipeline.yml
+        outputs_per_response:
+            Number of <OUTPUT> documents expected in each response
+
+    Returns:
+        LLMClient instance
+    """
+    retry_config = llm_config.get("retry") or {}
+    max_attempts = retry_config.get("max_attempts", 1)
+
+    # the retry layer replaces the SDKs' own retries rather than multiplying them
+    client = create_provider_client(
+        provider,
+        llm_config,
+        outputs_per_response,
+        sdk_max_retries=0 if max_attempts > 1 else None,
+    )
+    config = llm_config.get(provider) or {}
+
+    adaptive_config = (concurrency_config or {}).get("adaptive") or {}
+    if adaptive_config.get("enabled", False):
+        from utils.concurrency import AdaptiveConcurrencyClient, get_adaptive_limit
+
+        adaptive_limit = get_adaptive_limit(provider, adaptive_config)
+        client = AdaptiveConcurrencyClient(client, adaptive_limit)
+
+    if config.get("rate_limits"):
+        from utils.rate_limit import RateLimitedClient, get_rate_limiter
+
+        client = RateLimitedClient(client, get_rate_limiter(provider, config["rate_limits"]))
+
+    # outside the limiters, so every attempt waits for budget and a slot
+    if max_attempts > 1:
+        from utils.retry import RetryingClient, get_retry_budget
+
+        client = RetryingClient(
+            client,
+            get_retry_budget(provider, retry_config),
+            max_attempts=max_attempts,
+            base_delay=retry_config.get("base_delay", 1.0),
+            max_delay=retry_config.get("max_delay", 60.0),
+        )
+
+    # errors are counted once per logical request, after any retries
+    if adaptive_config.get("enabled", False):
+        from utils.concurrency import AdaptiveOutcomeClient
+
+        client = AdaptiveOutcomeClient(client, adaptive_limit)
+
+    hedging_config = llm_config.get("hedging") or {}
+    if hedging_config.get("enabled", False):
+        from utils.hedging import HedgedClient, get_hedge_policy
+
+        # blocking calls are raced on threads, enough for every call the executor can make
+        max_in_flight = (concurrency_config or {}).get("max_in_flight", 8)
+        if adaptive_config.get("enabled", False):
+            max_in_flight = adaptive_config.get("max", 64)
+        client = HedgedClient(client, get_hedge_policy(provider, hedging_config), max_in_flight)
+
+    cache_config = llm_config.get("cache") or {}
+    # YAML reads an unquoted off as False
+    cache_mode = cache_config.get("mode") or "off"
+    if cache_mode != "off":
+        from utils.response_cache import CachedClient, get_response_cache
+
+        client = CachedClient(
+            client, get_response_cache(cache_config), cache_mode, outputs_per_response
+        )
+
+    return client
+
+
+def create_provider_client(
+    provider: str,
+    llm_config: dict,
+    outputs_per_response: int = 1,
+    sdk_max_retries: Optional[int] = None,
+) -> LLMClient:
+    """
+    Create the bare client for a single provider, without any wrappers.
+
+    Args:
+        provider:
+            Provider name ('gemini', 'claude', 'local', 'llamacpp', 'mock' or 'replay')
+        llm_config:
+            Dictionary containing LLM configuration from pipeline.yml
+        outputs_per_response:
+            Number of <OUTPUT> documents expected in each response
+        sdk_max_retries:
+            Override for the Anthropic/OpenAI SDK retry count (None keeps the default)
+
+    Returns:
+        LLMClient instance
+    """
+    # a </OUTPUT> stop sequence would cut multi-document responses after the
+    # first document, so those rely on streaming to stop early instead
+    stop_at_output_end = llm_config.get("stop_at_output_end", False)
+    output_options = {
+        "stream": llm_config.get("stream", False),
+        "stop_sequences": (
+            [OUTPUT_CLOSE_TAG] if stop_at_output_end and outputs_per_response == 1 else None
+        ),
+        "outputs_per_response": outputs_per_response,
+    }
+    # options for the clients built on the Anthropic/OpenAI SDKs
+    sdk_options = {} if sdk_max_retries is None else {"max_retries": sdk_max_retries}
+    if llm_config.get("http") and provider in ("claude", "local"):
+        from utils.http_transport import get_http_clients
+
+        sdk_options["http_clients"] = get_http_clients(llm_config["http"])
+    config = llm_config.get(provider) or {}
+    timeout_options = {
+        "connect_timeout": config.get("connect_timeout"),
+        "read_timeout": config.get("read_timeout"),
+    }
+
+    if provider == "gemini":
         config = llm_config["gemini"]
         return GeminiClient(
             model=config["model"],
             temperature=config.get("temperature", 1.0),
             max_tokens=config.get("max_tokens", 4000),
+            **output_options,
+            **timeout_options,
         )
 
     elif provider == "claude":
@@ -294,24 +1344,75 @@ def create_llm_client(llm_config: dict) -> Optional[LLMClient]:
             model=config["model"],
             temperature=config.get("temperature", 1.0),
             max_tokens=config.get("max_tokens", 4000),
+            base_url=config.get("base_url"),
+            prompt_caching=config.get("prompt_caching", True),
+            **output_options,
+            **sdk_options,
+            **timeout_options,
         )
 
     elif provider == "local":
         config = llm_config["local"]
-        # Read base_url and model from environment variables
-        base_url = os.getenv("LOCAL_LLM_BASE_URL")
+        # Read base_url and model from environment variables; several replicas
+        # can be given as a comma-separated LOCAL_LLM_BASE_URL or local.base_urls
+        base_urls = config.get("base_urls") or os.getenv("LOCAL_LLM_BASE_URL", "").split(",")
+        base_urls = [url.strip() for url in base_urls if url.strip()]
         model = os.getenv("LOCAL_LLM_MODEL")
 
-        if not base_url:
+        if not base_urls:
             raise ValueError("LOCAL_LLM_BASE_URL not found in environment variables")
         if not model:
             raise ValueError("LOCAL_LLM_MODEL not found in environment variables")
 
-        return LocalClient(
-            base_url=base_url,
-            model=model,
+        clients = [
+            LocalClient(
+                base_url=base_url,
+                model=model,
+                temperature=config.get("temperature", 1.0),
+                max_tokens=config.get("max_tokens", 4000),
+                **output_options,
+                **sdk_options,
+                **timeout_options,
+            )
+            for base_url in base_urls
+        ]
+        if len(clients) == 1:
+            return clients[0]
+
+        from utils.endpoint_pool import EndpointPool
+
+        return EndpointPool(
+            clients,
+            routing=config.get("routing", "least_outstanding"),
+            health_check_interval=config.get("health_check_interval", 30),
+            ejection_cooldown=config.get("ejection_cooldown", 30),
+        )
+
+    elif provider == "llamacpp":
+        config = llm_config["llamacpp"]
+        model_path = config.get("model_path") or os.getenv("LLAMA_MODEL_PATH")
+        if not model_path:
+            raise ValueError("llamacpp.model_path or LLAMA_MODEL_PATH must be set")
+
+        return LlamaCppClient(
+            model_path=model_path,
             temperature=config.get("temperature", 1.0),
             max_tokens=config.get("max_tokens", 4000),
+            n_ctx=config.get("n_ctx", 8192),
+            n_threads=config.get("n_threads"),
+            n_batch=config.get("n_batch", 512),
+            prefix_cache_mb=config.get("prefix_cache_mb", 2048),
+            **output_options,
+        )
+
+    elif provider in ("mock", "replay"):
+        from utils.mock_clients import create_offline_client
+
+        return create_offline_client(
+            provider,
+            llm_config.get(provider) or {},
+            outputs_per_response,
+            output_options["stop_sequences"],
         )
 
     else:
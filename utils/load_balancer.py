@@ -0,0 +1,100 @@
+import logging
+import random
+import threading
+
+from utils.circuit_breaker import FailoverClient
+
+"""
+load_balancer.py - spread LLM requests over several providers in one run
+"""
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ("weighted", "least_outstanding")
+
+# in-flight requests per provider, shared by every balancer in the process
+# (the threaded executor creates one client per worker)
+_outstanding = {}
+_outstanding_lock = threading.Lock()
+
+
+class LoadBalancedClient(FailoverClient):
+    """
+    Composite client that sends each request to one of several providers.
+
+    'weighted' picks a provider at random in proportion to its weight;
+    'least_outstanding' picks the provider with the fewest in-flight
+    requests per unit of weight. The remaining providers, then any
+    fallback routes, are tried in turn if the chosen provider's circuit is
+    open or the request fails with an outage error.
+    """
+
+    def __init__(self, routes, weights, strategy="least_outstanding", fallback_routes=None):
+        """
+        Args:
+            routes:
+                List of (CircuitBreaker, LLMClient) pairs, one per balanced provider
+            weights:
+                Weight of each route, in the same order
+            strategy:
+                'weighted' or 'least_outstanding'
+            fallback_routes:
+                Optional (CircuitBreaker, LLMClient) pairs tried only after every
+                balanced provider
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown load balancing strategy: {strategy}")
+        if len(weights) != len(routes) or any(w <= 0 for w in weights):
+            raise ValueError(f"Load balancing weights must be positive, got {weights}")
+
+        super().__init__(list(routes) + list(fallback_routes or []))
+        self.balanced = list(zip(routes, weights))
+        self.fallback_routes = list(fallback_routes or [])
+        self.strategy = strategy
+
+        with _outstanding_lock:
+            for breaker, _ in self.routes:
+                _outstanding.setdefault(breaker.provider, 0)
+
+    def request_routes(self):
+        if self.strategy == "weighted":
+            remaining = list(self.balanced)
+            ordered = []
+            while remaining:
+                choice = random.choices(remaining, weights=[w for _, w in remaining])[0]
+                remaining.remove(choice)
+                ordered.append(choice[0])
+        else:
+            # shuffled first so ties (e.g. every provider idle) are broken at random
+            shuffled = random.sample(self.balanced, len(self.balanced))
+            with _outstanding_lock:
+                ordered = [
+                    route
+                    for route, _ in sorted(
+                        shuffled,
+                        key=lambda item: (_outstanding[item[0][0].provider] + 1) / item[1],
+                    )
+                ]
+        return ordered + self.fallback_routes
+
+    def call_route(self, client, prompt, n):
+        self._enter(client.provider)
+        try:
+            return client.generate_samples(prompt, n)
+        finally:
+            self._exit(client.provider)
+
+    async def acall_route(self, client, prompt, n):
+        self._enter(client.provider)
+        try:
+            return await client.agenerate_samples(prompt, n)
+        finally:
+            self._exit(client.provider)
+
+    def _enter(self, provider):
+        with _outstanding_lock:
+            _outstanding[provider] += 1
+
+    def _exit(self, provider):
+        with _outstanding_lock:
+            _outstanding[provider] -= 1
@@ -14,10 +14,12 @@ class ProfileLoader:
         self.profiles_dir = base_dir / "config" / "profiles"
         self.all_profiles = []
         self.profile_files = []
+        self.profile_index = {}
 
     def load_all_profiles(self):
         self.profile_files = sorted(self.profiles_dir.glob("*.yml"))
         self.all_profiles = []
+        self.profile_index = {}
 
         for profile_file in self.profile_files:
             profiles = self._load_profiles_from_file(profile_file)
@@ -27,6 +29,7 @@ class ProfileLoader:
 
     def load_profiles_from_files(self, filenames):
         self.all_profiles = []
+        self.profile_index = {}
         for filename in filenames:
             file_path = self.profiles_dir / filename
             if not file_path.exists():
@@ -56,10 +59,21 @@ class ProfileLoader:
 
         return profiles
 
-    def get_random_profile(self):
+    def get_random_profile(self, rng=random):
         if not self.all_profiles:
             raise ValueError("No profiles loaded.")
-        return random.choice(self.all_profiles)
+        return rng.choice(self.all_profiles)
+
+    def get_profile(self, source_file, profile_id):
+        """
+        Look up a loaded profile; ids are only unique within their source file
+        """
+        if not self.profile_index:
+            self.profile_index = {(p["source_file"], p["profile_id"]): p for p in self.all_profiles}
+        try:
+            return self.profile_index[(source_file, profile_id)]
+        except KeyError:
+            raise KeyError(f"Profile {profile_id} not loaded from {source_file}")
 
     def get_sequential_profiles(self):
         if not self.all_profiles:
@@ -19,7 +19,7 @@ class ConfigSampler:
         with open(path, "r") as f:
             return yaml.safe_load(f)
 
-    def _sample_section(self, section_data):
+    def _sample_section(self, section_data, rng=random):
         mutually_exclusive = section_data.get("_mutually_exclusive", False)
         items = {k: v for k, v in section_data.items() if not k.startswith("_")}
 
@@ -28,32 +28,60 @@ class ConfigSampler:
         if mutually_exclusive:
             choices = list(items.keys())
             weights = [items[c]["probability"] for c in choices]
-            chosen = random.choices(choices, weights=weights, k=1)[0]
+            chosen = rng.choices(choices, weights=weights, k=1)[0]
             description = items[chosen]["description"]
             if description:
                 selected.append({"key": chosen, "description": description})
         else:
             for key, config in items.items():
                 probability = config["probability"]
-                if random.random() < probability:
+                if rng.random() < probability:
                     description = config["description"]
                     if description:
                         selected.append({"key": key, "description": description})
 
         return selected
 
-    def sample_style_config(self):
+    def sample_style_config(self, rng=random):
         result = {}
         for section_name, section_data in self.style_data.items():
-            result[section_name] = self._sample_section(section_data)
+            result[section_name] = self._sample_section(section_data, rng)
         return result
 
-    def sample_content_config(self):
+    def sample_content_config(self, rng=random):
         result = {}
         for section_name, section_data in self.content_data.items():
-            result[section_name] = self._sample_section(section_data)
+            result[section_name] = self._sample_section(section_data, rng)
         return result
 
+    @staticmethod
+    def sampled_keys(sampled):
+        """
+        Compact form of a sampled config: the selected keys per non-empty section
+        """
+        return {section: [item["key"] for item in items] for section, items in sampled.items() if items}
+
+    def _from_keys(self, data, keys):
+        return {
+            section_name: [
+                {"key": key, "description": section_data[key]["description"]}
+                for key in keys.get(section_name, [])
+            ]
+            for section_name, section_data in data.items()
+        }
+
+    def style_config_from_keys(self, keys):
+        """
+        Rebuild a sampled style config from sampled_keys()
+        """
+        return self._from_keys(self.style_data, keys)
+
+    def content_config_from_keys(self, keys):
+        """
+        Rebuild a sampled content config from sampled_keys()
+        """
+        return self._from_keys(self.content_data, keys)
+
     def format_style_prompt(self, sampled_style):
         lines = ["## FOLLOW THESE STYLE REQUIREMENTS"]
         lines.append("")
@@ -28,11 +28,11 @@ class StructureLoader:
 
         return self.structures
 
-    def get_random_structure(self):
+    def get_random_structure(self, rng=random):
         if not self.structures:
             raise ValueError("No structures loaded.")
 
-        filename = random.choice(list(self.structures.keys()))
+        filename = rng.choice(list(self.structures.keys()))
         content = self.structures[filename]
         return filename, content
 
@@ -40,7 +40,7 @@ class StructureLoader:
         lines = ["## MIMIC THIS DOCUMENT STRUCTURE"]
         lines.append("")
         lines.append(
-            "Use the following example as a close guide for the structure of the synthetic document. Mimic this example as far as possible. Closely follow how text is organised (e.g. in block text, or in subheadings and bullets, how colons are used) and the pattern of paragraphs and newlines. If the example structure is too short to capture all the content you need to generate, extend the structure in exactly the same way to make your synthetic document. The style points given above should be applied to this example structure, without materially changing it"
+            "Use the following example as a close guide for the structure of the synthetic document. Mimic this example as far as possible. Closely follow how text is organised (e.g. in block text, or in subheadings and bullets, how colons are used) and the pattern of paragraphs and newlines. If the example structure is too short to capture all the content you need to generate, extend the structure in exactly the same way to make your synthetic document. The style points given in the specific instructions should be applied to this example structure, without materially changing it"
         )
         lines.append("")
         lines.append("```")
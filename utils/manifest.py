@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+"""
+manifest.py - append-only record of completed and failed documents, for resuming runs
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """
+    JSON lines of {doc_id, status, time[, error]} appended as documents are
+    saved or fail, in the output directory.
+
+    Every record is flushed to the OS straight away and fsync'd by a
+    background thread within sync_interval seconds, so a machine crash loses
+    at most that much completed work and a killed process loses none.
+    """
+
+    def __init__(self, path, sync_interval=2.0):
+        """
+        Args:
+            path:
+                Manifest file, created if missing and appended to otherwise
+            sync_interval:
+                Maximum seconds between fsyncs of new records
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a")
+        self.unsynced = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="manifest-sync", daemon=True)
+        self.thread.start()
+
+    def record(self, doc_id, status, error=None):
+        entry = {"doc_id": doc_id, "status": status, "time": datetime.now().isoformat()}
+        if error is not None:
+            entry["error"] = str(error)
+
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            self.unsynced += 1
+
+    def _run(self):
+        while not self.stopped.wait(self.sync_interval):
+            with self.lock:
+                self._sync()
+
+    def _sync(self):
+        if self.unsynced and not self.file.closed:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        with self.lock:
+            if not self.file.closed:
+                self._sync()
+                self.file.close()
+
+
+def load_manifest(path):
+    """
+    Latest status per doc_id from a manifest, or {} if there is none
+    A partly written last line (from a crash mid-write) is ignored
+    """
+    statuses = {}
+    if not path.exists():
+        return statuses
+
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable manifest line in {path}: {line!r}")
+                continue
+            statuses[entry["doc_id"]] = entry["status"]
+    return statuses
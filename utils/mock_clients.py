@@ -0,0 +1,296 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+from utils.llm_clients import LLMClient
+from utils.rate_limit import CHARS_PER_TOKEN
+
+"""
+mock_clients.py - offline LLM clients for benchmarking the pipeline without a provider
+"""
+
+logger = logging.getLogger(__name__)
+
+# relative replay paths in pipeline.yml are resolved against the project directory
+BASE_DIR = Path(__file__).parent.parent
+
+# plan index at the end of a document ID, before any _s{n} sample suffix
+DOC_INDEX_PATTERN = re.compile(r"_(\d+)(?:_s\d+)?$")
+
+FILLER_WORDS = (
+    "patient presented with history of pain review examination noted plan follow "
+    "up clinic letter referral assessment treatment medication dose daily reported "
+    "findings imaging results stable discussed advised symptoms recent weeks"
+).split()
+
+
+class MockProviderError(Exception):
+    """
+    Simulated provider failure, carrying an HTTP status like the real SDK errors
+    """
+
+    def __init__(self, status_code):
+        super().__init__(f"Mock provider error {status_code}")
+        self.status_code = status_code
+
+
+class MockClient(LLMClient):
+    """
+    Returns synthetic <OUTPUT> responses after a simulated delay.
+
+    Latency is log-normal around latency_median, response length is normal
+    around response_tokens_mean (truncated at max_tokens, leaving the output
+    unterminated as a real provider would), and error_rate of calls fail
+    with a retryable status. Every draw comes from a generator seeded by
+    seed, the prompt and how many times that prompt has been sent, so a run
+    is reproducible regardless of the order requests complete in.
+    """
+
+    provider = "mock"
+    native_samples = False
+
+    def __init__(
+        self,
+        seed: int = 0,
+        latency_median: float = 2.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        response_tokens_mean: int = 800,
+        response_tokens_sd: int = 200,
+        max_tokens: int = 4000,
+        temperature: float = 1.0,
+        stop_sequences=None,
+        outputs_per_response: int = 1,
+    ):
+        """
+        Args:
+            seed:
+                Seed for every random draw
+            latency_median:
+                Median simulated latency in seconds (0 for no delay)
+            latency_sigma:
+                Spread of the log-normal latency distribution
+            error_rate:
+                Fraction of calls that raise MockProviderError
+            response_tokens_mean / response_tokens_sd:
+                Normal distribution of response length in tokens
+            max_tokens:
+                Responses longer than this are cut off mid-output
+            temperature:
+                Recorded only, for the response cache key
+            stop_sequences:
+                Recorded only, for the response cache key
+            outputs_per_response:
+                Number of <OUTPUT id="n"> documents per response
+        """
+        self.seed = seed
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.response_tokens_mean = response_tokens_mean
+        self.response_tokens_sd = response_tokens_sd
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop_sequences = stop_sequences
+        self.outputs_per_response = outputs_per_response
+        self.model = self.provider
+
+        self.calls = defaultdict(int)
+        self.lock = threading.Lock()
+
+        logger.info(
+            f"Initialised {type(self).__name__} with seed={seed}, latency_median={latency_median}s, "
+            f"error_rate={error_rate}"
+        )
+
+    def _rng(self, prompt: str) -> random.Random:
+        digest = hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+        with self.lock:
+            self.calls[digest] += 1
+            call = self.calls[digest]
+        return random.Random(f"{self.seed}:{digest}:{call}")
+
+    def _plan(self, prompt: str):
+        """
+        Draw (latency, error, response text) for one call
+        """
+        rng = self._rng(prompt)
+        latency = 0.0
+        if self.latency_median:
+            latency = self.latency_median * rng.lognormvariate(0, self.latency_sigma)
+        if rng.random() < self.error_rate:
+            return latency, MockProviderError(rng.choice((429, 500, 503))), None
+        return latency, None, self._response_text(prompt, rng)
+
+    def _response_text(self, prompt: str, rng: random.Random) -> str:
+        documents = []
+        for output_id in range(1, self.outputs_per_response + 1):
+            tokens = max(1, int(rng.gauss(self.response_tokens_mean, self.response_tokens_sd)))
+            # sized in characters, the unit token estimates and max_tokens truncation use
+            target_chars = tokens * CHARS_PER_TOKEN
+            words, length = [], 0
+            while length < target_chars:
+                word = rng.choice(FILLER_WORDS)
+                words.append(word)
+                length += len(word) + 1
+            body = " ".join(words)
+            tag = "<OUTPUT>" if self.outputs_per_response == 1 else f'<OUTPUT id="{output_id}">'
+            documents.append(f"{tag}\n{body}\n</OUTPUT>")
+        text = "\n\n".join(documents)
+        # response truncated at max_tokens, like a real provider
+        return text[: self.max_tokens * CHARS_PER_TOKEN]
+
+    def generate(self, prompt: str) -> str:
+        latency, error, text = self._plan(prompt)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return text
+
+    async def agenerate(self, prompt: str) -> str:
+        latency, error, text = self._plan(prompt)
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return text
+
+
+class ReplayClient(MockClient):
+    """
+    Serves the documents saved by an earlier run (its output JSONs) as
+    responses, with the latency and error model of MockClient.
+
+    With match 'prompt' only documents saved for the exact same prompt are
+    served and other prompts fail; with 'any' such prompts are served
+    recorded documents in turn, so runs with freshly sampled prompts can
+    still replay real content.
+    """
+
+    provider = "replay"
+
+    def __init__(self, path, match: str = "any", latency_median: float = 0.0, **options):
+        """
+        Args:
+            path:
+                Directory of output JSONs from an earlier run
+            match:
+                'prompt' or 'any'
+            latency_median:
+                Median simulated latency in seconds (default no delay)
+            options:
+                Other MockClient options
+        """
+        if match not in ("prompt", "any"):
+            raise ValueError(f"Unknown replay match mode: {match}")
+
+        self.path = Path(path)
+        self.match = match
+        documents = defaultdict(list)
+        self.recorded = []
+        for file in sorted(self.path.glob("*.json")):
+            with open(file, "r") as f:
+                document = json.load(f)
+            if document.get("content"):
+                documents[document["prompt"]].append(document)
+                self.recorded.append(document["content"])
+
+        # each prompt's documents regrouped into the responses they came from,
+        # {output id: content} per sample, so replayed documents keep their ids
+        self.by_prompt = {
+            prompt: self._responses(prompt_documents)
+            for prompt, prompt_documents in documents.items()
+        }
+
+        if not self.recorded:
+            raise ValueError(f"No generated documents to replay in {self.path}")
+
+        self.next_recorded = 0
+        super().__init__(latency_median=latency_median, **options)
+        logger.info(f"Loaded {len(self.recorded)} recorded documents from {self.path}")
+
+    @staticmethod
+    def _responses(documents: list) -> list:
+        """
+        Group the documents saved from one prompt by sample, numbering each
+        by its plan index relative to the prompt's first document
+        """
+        indexed = []
+        for document in documents:
+            match = DOC_INDEX_PATTERN.search(document.get("doc_id", ""))
+            indexed.append((int(match.group(1)) if match else 0, document))
+        first = min(index for index, _ in indexed)
+
+        responses = defaultdict(dict)
+        for index, document in indexed:
+            responses[document.get("sample", 1)][index - first + 1] = document["content"]
+        return [responses[sample] for sample in sorted(responses)]
+
+    def _contents(self, prompt: str, count: int, call: int) -> Optional[list]:
+        """
+        Contents for each output id of a response, None where the recorded
+        response had no document for that id
+        """
+        responses = self.by_prompt.get(str(prompt))
+        if responses:
+            response = responses[(call - 1) % len(responses)]
+            return [response.get(output_id) for output_id in range(1, count + 1)]
+        if self.match == "prompt":
+            return None
+
+        with self.lock:
+            start = self.next_recorded
+            self.next_recorded += count
+        return [self.recorded[(start + i) % len(self.recorded)] for i in range(count)]
+
+    def _response_text(self, prompt: str, rng: random.Random) -> str:
+        digest = hashlib.sha256(str(prompt).encode("utf-8")).hexdigest()
+        contents = self._contents(prompt, self.outputs_per_response, self.calls[digest])
+        if contents is None:
+            raise KeyError("No recorded response for prompt (match: prompt)")
+
+        if self.outputs_per_response == 1:
+            return f"<OUTPUT>\n{contents[0]}\n</OUTPUT>"
+        # documents missing from the recording are left out, as they were originally
+        return "\n\n".join(
+            f'<OUTPUT id="{i}">\n{content}\n</OUTPUT>'
+            for i, content in enumerate(contents, 1)
+            if content is not None
+        )
+
+
+# pipeline.yml keys passed to the clients (rate_limits etc. are handled by the wrappers)
+CLIENT_OPTIONS = (
+    "seed",
+    "latency_median",
+    "latency_sigma",
+    "error_rate",
+    "response_tokens_mean",
+    "response_tokens_sd",
+    "max_tokens",
+    "temperature",
+    "path",
+    "match",
+)
+
+
+def create_offline_client(provider, config, outputs_per_response=1, stop_sequences=None):
+    """
+    Create a MockClient or ReplayClient from its pipeline.yml section
+    """
+    options = {key: config[key] for key in CLIENT_OPTIONS if key in config}
+    options.update(outputs_per_response=outputs_per_response, stop_sequences=stop_sequences)
+    if provider == "mock":
+        return MockClient(**options)
+
+    path = options.pop("path", None)
+    if not path:
+        raise ValueError("replay.path must point to an earlier run's output folder")
+    return ReplayClient(BASE_DIR / path, **options)
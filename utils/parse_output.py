@@ -0,0 +1,143 @@
+import logging
+import re
+
+"""
+parse_output.py - extracts generated documents from raw LLM responses
+"""
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_OPEN_TAG = "<OUTPUT"
+OUTPUT_CLOSE_TAG = "</OUTPUT>"
+
+# the body may not contain another opening tag, so an unterminated document
+# cannot swallow the one after it
+INDEXED_OUTPUT_PATTERN = re.compile(
+    r'<OUTPUT id="?(\d+)"?>((?:(?!<OUTPUT).)*?)</OUTPUT>', re.DOTALL
+)
+OPEN_INDEXED_OUTPUT_PATTERN = re.compile(r'<OUTPUT id="?(\d+)"?>')
+
+
+def extract_output_content(response_text):
+    """
+    Extract content between <OUTPUT> tags
+    """
+    pattern = r"<OUTPUT>(.*?)</OUTPUT>"
+    match = re.search(pattern, response_text, re.DOTALL)
+
+    if match:
+        content = match.group(1).strip()
+        logger.debug(
+            f"Successfully extracted content from <OUTPUT> tags (length={len(content)} chars)"
+        )
+        return content
+    else:
+        logger.warning("No <OUTPUT> tags found in response, using full response text")
+        return response_text.strip()
+
+
+def extract_indexed_outputs(response_text, expected_count):
+    """
+    Extract every complete <OUTPUT id="n"> document from a multi-document response
+
+    Documents are validated individually: ids outside 1..expected_count,
+    repeated ids and empty documents are dropped. A document whose closing
+    tag is missing (response truncated) is dropped too, but every complete
+    document before it is kept.
+
+    Returns:
+        Dict mapping output id to document content
+    """
+    outputs = {}
+
+    for match in INDEXED_OUTPUT_PATTERN.finditer(response_text):
+        output_id = int(match.group(1))
+        content = match.group(2).strip()
+
+        if not 1 <= output_id <= expected_count:
+            logger.warning(f"Ignoring unexpected <OUTPUT id=\"{output_id}\"> (expected 1-{expected_count})")
+        elif output_id in outputs:
+            logger.warning(f"Ignoring repeated <OUTPUT id=\"{output_id}\">")
+        elif not content:
+            logger.warning(f"Ignoring empty <OUTPUT id=\"{output_id}\">")
+        else:
+            outputs[output_id] = content
+
+    opened = {int(m.group(1)) for m in OPEN_INDEXED_OUTPUT_PATTERN.finditer(response_text)}
+    incomplete = sorted(i for i in opened if 1 <= i <= expected_count and i not in outputs)
+    if incomplete:
+        logger.warning(f"Discarding unterminated or empty outputs with ids {incomplete}")
+
+    logger.debug(f"Extracted {len(outputs)}/{expected_count} documents from multi-document response")
+    return outputs
+
+
+def response_complete(response_text, expected_count=1):
+    """
+    True if every expected document can be extracted from a response
+    Checks quietly, without the warnings logged when documents are extracted
+    """
+    if expected_count == 1:
+        return bool(response_text.strip())
+
+    found = set()
+    for match in INDEXED_OUTPUT_PATTERN.finditer(response_text):
+        if match.group(2).strip():
+            found.add(int(match.group(1)))
+    return found >= set(range(1, expected_count + 1))
+
+
+def close_unterminated_output(response_text):
+    """
+    Append a closing tag when the response ends inside an <OUTPUT> block.
+    Used when generation stopped on the </OUTPUT> stop sequence, which
+    providers strip from the returned text.
+    """
+    if response_text.count(OUTPUT_OPEN_TAG) > response_text.count(OUTPUT_CLOSE_TAG):
+        return response_text + OUTPUT_CLOSE_TAG
+    return response_text
+
+
+class OutputStream:
+    """
+    Incremental reader for a streamed response that reports when the
+    expected number of </OUTPUT> tags has been received, so the caller can
+    stop the stream instead of paying for trailing commentary
+    """
+
+    def __init__(self, expected_outputs=1):
+        self.expected_outputs = expected_outputs
+        self.parts = []
+        self.closed = 0
+        self.finish_reason = None
+        # end of the previous chunk, in case a tag is split across chunks
+        self._tail = ""
+
+    def feed(self, chunk):
+        """
+        Add a chunk of text and return True once the output is complete
+        """
+        self.parts.append(chunk)
+        window = self._tail + chunk
+        # the tail is shorter than the tag, so every match here is new
+        self.closed += window.count(OUTPUT_CLOSE_TAG)
+        self._tail = window[-(len(OUTPUT_CLOSE_TAG) - 1):]
+        return self.complete
+
+    @property
+    def complete(self):
+        return self.closed >= self.expected_outputs
+
+    @property
+    def text(self):
+        """
+        Text received so far, cut after the final expected closing tag
+        """
+        text = "".join(self.parts)
+        if not self.complete:
+            return text
+
+        end = -1
+        for _ in range(self.expected_outputs):
+            end = text.index(OUTPUT_CLOSE_TAG, end + 1)
+        return text[: end + len(OUTPUT_CLOSE_TAG)]
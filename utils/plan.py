@@ -0,0 +1,202 @@
+import json
+import logging
+import os
+import random
+from datetime import datetime
+
+from utils.rate_limit import estimate_tokens
+
+"""
+plan.py - materialise every generation job up front into a plan file
+"""
+
+logger = logging.getLogger(__name__)
+
+
+def document_seed(run_seed, index):
+    """
+    Seed for the draws of one document, derived from the run seed and its
+    index so any document can be re-drawn on its own
+    """
+    return random.Random(f"{run_seed}:{index}").getrandbits(32)
+
+
+def generate_doc_id(structure_name, profile_id, run_id, index):
+    """
+    Document ID as {structure}_{profile}_{run_id}_{index}, the same every
+    time the plan is executed
+    """
+    return f"{structure_name}_{profile_id}_{run_id}_{index:05d}"
+
+
+def create_plan(builder, settings):
+    """
+    Draw the profile, structure and style/content requirements of every
+    document and group them into jobs, one per LLM call
+
+    Each document is drawn from its own generator seeded by document_seed,
+    so the plan for a given seed does not depend on how it is split up.
+
+    Args:
+        builder:
+            PromptBuilder with structures and profiles loaded
+        settings:
+            Plan header from plan_settings(); a missing seed is drawn and
+            recorded, as is the resolved document count
+    Returns the completed settings and the list of jobs
+    """
+    if settings.get("seed") is None:
+        settings["seed"] = random.SystemRandom().getrandbits(32)
+    if settings["total_docs"] == -1:
+        settings["total_docs"] = builder.get_profile_count()
+
+    mode = settings["mode"]
+    if mode == "sequential":
+        profiles = builder.get_sequential_profiles()
+    elif mode != "random":
+        raise ValueError(f"Unknown profile selection mode: {mode}")
+
+    documents = []
+    for index in range(1, settings["total_docs"] + 1):
+        seed = document_seed(settings["seed"], index)
+        rng = random.Random(seed)
+        if mode == "random":
+            profile = builder.get_random_profile(rng)
+        else:
+            profile = next(profiles, None)
+            if profile is None:
+                break
+
+        spec = builder.sample_document(
+            profile, rng, settings["include_style"], settings["include_content"]
+        )
+        structure_name = builder.structure_loader.get_structure_name_without_extension(
+            spec["structure"]
+        )
+        doc_id = generate_doc_id(structure_name, spec["profile"], settings["run_id"], index)
+        documents.append({"index": index, "doc_id": doc_id, "seed": seed, **spec})
+
+    settings["total_docs"] = len(documents)
+    docs_per_call = settings["docs_per_call"]
+    jobs = [
+        {"documents": documents[i : i + docs_per_call]}
+        for i in range(0, len(documents), docs_per_call)
+    ]
+    return settings, jobs
+
+
+def plan_settings(pipeline_config, seed=None, run_id=None):
+    """
+    Plan header from pipeline.yml: everything needed to rebuild the prompts
+    A count of -1 (every loaded profile) is resolved by create_plan
+    The run ID defaults to seed{seed} when the seed is fixed, so the same seed
+    always gives the same document IDs, and to a timestamp otherwise
+    """
+    prompt_config = pipeline_config["prompt_config"]
+    profile_selection = pipeline_config["profile_selection"]
+    if seed is None:
+        seed = profile_selection.get("seed")
+    if run_id is None:
+        run_id = f"seed{seed}" if seed is not None else datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    return {
+        "run_id": run_id,
+        "seed": seed,
+        "mode": profile_selection["mode"],
+        "total_docs": profile_selection["count"],
+        "profile_files": profile_selection.get("file"),
+        "enabled_structures": pipeline_config["structure_selection"]["enabled_structures"],
+        "prompt_template": prompt_config.get("prompt_template", "default"),
+        "include_style": prompt_config["include_style"],
+        "include_content": prompt_config["include_content"],
+        "docs_per_call": prompt_config.get("docs_per_call", 1),
+    }
+
+
+def write_plan(path, settings, jobs):
+    """
+    Write the plan as JSON lines: the settings, then one line per job
+    Written to a temporary file and renamed so a plan is never half written
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(settings) + "\n")
+        for job in jobs:
+            f.write(json.dumps(job, separators=(",", ":")) + "\n")
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote plan of {len(jobs)} jobs to {path}")
+
+
+def load_plan(path):
+    """
+    Read a plan written by write_plan
+    Returns the settings and the list of jobs
+    """
+    with open(path, "r") as f:
+        settings = json.loads(next(f))
+        jobs = [json.loads(line) for line in f if line.strip()]
+    logger.info(f"Loaded plan of {len(jobs)} jobs from {path}")
+    return settings, jobs
+
+
+def shard_jobs(jobs, shard_index, shard_count):
+    """
+    The jobs of one shard of a plan: every shard_count-th job starting at
+    shard_index, so shards are disjoint, similar in size and together cover
+    the whole plan
+    """
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Shard index {shard_index} out of range for {shard_count} shards")
+    return jobs[shard_index::shard_count]
+
+
+def latest_plan(output_dir):
+    """
+    Most recent plan file in an output directory, or None
+    """
+    plans = list(output_dir.glob("plan_*.jsonl"))
+    return max(plans, key=lambda path: path.stat().st_mtime) if plans else None
+
+
+def build_job(builder, job, docs_per_call=1, samples_per_prompt=1):
+    """
+    Build the executor job for a plan job: a dict of index, doc_id and prompt
+    With docs_per_call > 1 it also lists its 'documents', one per
+    <OUTPUT id="n"> expected in the response
+    With samples_per_prompt > 1 it asks for that many 'samples'
+    """
+    specs = job["documents"]
+    if docs_per_call == 1:
+        spec = specs[0]
+        prompt, _, _ = builder.build_planned_prompt(spec)
+        built = {"index": spec["index"], "doc_id": spec["doc_id"], "prompt": prompt}
+    else:
+        prompt, _ = builder.build_planned_multi_prompt(specs)
+        documents = [
+            {"index": spec["index"], "doc_id": spec["doc_id"], "output_id": output_id}
+            for output_id, spec in enumerate(specs, 1)
+        ]
+        built = {
+            "index": documents[0]["index"],
+            "doc_id": f"{documents[0]['doc_id']} (+{len(documents) - 1} more)",
+            "prompt": prompt,
+            "documents": documents,
+        }
+
+    if samples_per_prompt > 1:
+        built["samples"] = samples_per_prompt
+    return built
+
+
+def estimate_plan(builder, jobs, docs_per_call, max_tokens, samples_per_prompt=1):
+    """
+    Token estimate for executing a plan, from its prompts and max_tokens
+    Returns (calls, input_tokens, max_output_tokens), counting every sample
+    as a separate call
+    """
+    calls = len(jobs) * samples_per_prompt
+    input_tokens = sum(
+        estimate_tokens(build_job(builder, job, docs_per_call)["prompt"]) for job in jobs
+    )
+    return calls, input_tokens * samples_per_prompt, calls * max_tokens
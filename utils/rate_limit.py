@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import threading
+import time
+
+from utils.llm_clients import ClientWrapper, error_status_code, retry_after
+
+"""
+rate_limit.py - client-side request and token budgets for LLM providers
+"""
+
+logger = logging.getLogger(__name__)
+
+# rough English/markdown average, good enough to pace against provider limits
+CHARS_PER_TOKEN = 4
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """
+    Estimate token count from text length
+    """
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """
+    Continuously refilling bucket holding up to one minute of budget.
+
+    Callers reserve capacity up front and are told how long to wait; the
+    balance may go negative, which queues later callers behind earlier ones.
+    """
+
+    def __init__(self, per_minute):
+        if per_minute <= 0:
+            raise ValueError(f"Rate limit must be positive, got {per_minute}")
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """
+        Take amount from the bucket and return seconds to wait before using it
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount):
+        """
+        Return unused reservation to the bucket
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+    def pause(self, seconds):
+        """
+        Empty the bucket so nothing is admitted for at least the given seconds
+        """
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+    """
+    Request and input/output token budgets for one provider.
+    Shared by every client of that provider in the process.
+    """
+
+    def __init__(
+        self,
+        provider,
+        requests_per_minute=None,
+        input_tokens_per_minute=None,
+        output_tokens_per_minute=None,
+    ):
+        self.provider = provider
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.input_tokens = (
+            TokenBucket(input_tokens_per_minute) if input_tokens_per_minute else None
+        )
+        self.output_tokens = (
+            TokenBucket(output_tokens_per_minute) if output_tokens_per_minute else None
+        )
+
+        logger.info(
+            f"Initialised RateLimiter for {provider} with rpm={requests_per_minute}, "
+            f"input_tpm={input_tokens_per_minute}, output_tpm={output_tokens_per_minute}"
+        )
+
+    def acquire(self, prompt, max_output_tokens, requests=1):
+        """
+        Reserve budget for the given number of requests of this prompt and
+        return seconds to wait before sending.
+
+        Output tokens are reserved at max_output_tokens (as providers do) and
+        the unused part is refunded by release().
+        """
+        delays = [0.0]
+        if self.requests:
+            delays.append(self.requests.reserve(requests))
+        if self.input_tokens:
+            delays.append(self.input_tokens.reserve(estimate_tokens(prompt) * requests))
+        if self.output_tokens:
+            delays.append(self.output_tokens.reserve(max_output_tokens))
+
+        delay = max(delays)
+        if delay > 0:
+            logger.debug(f"Rate limiting {self.provider} request for {delay:.2f}s")
+        return delay
+
+    def release(self, max_output_tokens, responses=None):
+        """
+        Refund the output reservation not used by the responses
+        """
+        if self.output_tokens:
+            used = sum(estimate_tokens(response) for response in responses or [])
+            self.output_tokens.refund(max(0, max_output_tokens - used))
+
+    def throttled(self, error):
+        """
+        Back off every bucket after the provider rejected a request with 429
+        """
+        seconds = retry_after(error) or 1.0
+        logger.warning(f"{self.provider} returned 429, pausing requests for {seconds:.1f}s")
+        for bucket in (self.requests, self.input_tokens, self.output_tokens):
+            if bucket:
+                bucket.pause(seconds)
+
+
+def get_rate_limiter(provider, rate_limits):
+    """
+    Return the process-wide RateLimiter for a provider, creating it on first use.
+
+    Args:
+        provider:
+            Provider name, used as the sharing key
+        rate_limits:
+            Dict with any of requests_per_minute, input_tokens_per_minute and
+            output_tokens_per_minute
+    """
+    with _limiters_lock:
+        if provider not in _limiters:
+            _limiters[provider] = RateLimiter(provider, **rate_limits)
+        return _limiters[provider]
+
+
+class RateLimitedClient(ClientWrapper):
+    """
+    Wraps any LLMClient so calls wait for the provider's RPM/TPM budget
+    """
+
+    def __init__(self, client, limiter):
+        super().__init__(client)
+        self.limiter = limiter
+
+    def _reserve(self, prompt, n):
+        """
+        Reserve budget for n samples; clients without native multi-sample
+        support send n separate requests
+        """
+        requests = 1 if getattr(self.client, "native_samples", False) else n
+        max_output_tokens = getattr(self.client, "max_tokens", 0) * n
+        return max_output_tokens, self.limiter.acquire(prompt, max_output_tokens, requests)
+
+    def generate_samples(self, prompt, n):
+        max_output_tokens, delay = self._reserve(prompt, n)
+        if delay:
+            time.sleep(delay)
+
+        responses = None
+        try:
+            responses = self.client.generate_samples(prompt, n)
+            return responses
+        except Exception as e:
+            if error_status_code(e) == 429:
+                self.limiter.throttled(e)
+            raise
+        finally:
+            self.limiter.release(max_output_tokens, responses)
+
+    async def agenerate_samples(self, prompt, n):
+        max_output_tokens, delay = self._reserve(prompt, n)
+        if delay:
+            await asyncio.sleep(delay)
+
+        responses = None
+        try:
+            responses = await self.client.agenerate_samples(prompt, n)
+            return responses
+        except Exception as e:
+            if error_status_code(e) == 429:
+                self.limiter.throttled(e)
+            raise
+        finally:
+            self.limiter.release(max_output_tokens, responses)
@@ -0,0 +1,244 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from utils.llm_clients import ClientWrapper
+from utils.parse_output import response_complete
+
+"""
+response_cache.py - persistent SQLite cache of LLM responses
+"""
+
+logger = logging.getLogger(__name__)
+
+# relative cache paths in pipeline.yml are resolved against the project directory
+BASE_DIR = Path(__file__).parent.parent
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_key(prompt, params):
+    """
+    Stable hash of the prompt text and the parameters that determine a response
+    """
+    payload = json.dumps({"prompt": str(prompt), **params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed store of responses keyed by cache_key().
+
+    Entries older than ttl_seconds are treated as missing and removed.
+    When max_entries or max_bytes is exceeded the least recently used
+    entries are evicted.
+    """
+
+    def __init__(self, path, ttl_seconds=None, max_entries=None, max_bytes=None):
+        """
+        Args:
+            path:
+                SQLite database file (created if missing)
+            ttl_seconds:
+                Maximum entry age, or None to keep entries indefinitely
+            max_entries:
+                Maximum number of entries, or None for no limit
+            max_bytes:
+                Maximum total size of stored responses, or None for no limit
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                responses TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self.connection.commit()
+
+        logger.info(
+            f"Opened response cache {path} (ttl={ttl_seconds}s, max_entries={max_entries}, max_bytes={max_bytes})"
+        )
+
+    def get(self, key):
+        """
+        Return the cached list of responses for key, or None
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT responses, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            responses, created = row
+            if self.ttl_seconds is not None and now - created > self.ttl_seconds:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.connection.commit()
+                self.misses += 1
+                return None
+
+            self.connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.connection.commit()
+            self.hits += 1
+            return json.loads(responses)
+
+    def put(self, key, responses):
+        """
+        Store a list of responses under key, then evict to stay within limits
+        """
+        now = time.time()
+        data = json.dumps(list(responses))
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, responses, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict(now)
+            self.connection.commit()
+
+    def _evict(self, now):
+        if self.ttl_seconds is not None:
+            self.connection.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,)
+            )
+
+        if self.max_entries is not None:
+            self.connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+        if self.max_bytes is not None:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                rows = self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed ASC"
+                ).fetchall()
+                evicted = []
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((key,))
+                    total -= size
+                self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+                logger.debug(f"Evicted {len(evicted)} cached responses to stay under {self.max_bytes} bytes")
+
+
+def get_response_cache(cache_config):
+    """
+    Return the process-wide ResponseCache for the configured database file,
+    opening it on first use
+
+    Args:
+        cache_config:
+            llm.cache section of pipeline.yml
+    """
+    path = BASE_DIR / cache_config.get("path", "output/response_cache.sqlite")
+    ttl_days = cache_config.get("ttl_days")
+    max_megabytes = cache_config.get("max_megabytes")
+
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(
+                path,
+                ttl_seconds=ttl_days * 86400 if ttl_days else None,
+                max_entries=cache_config.get("max_entries"),
+                max_bytes=int(max_megabytes * 1024 * 1024) if max_megabytes else None,
+            )
+        return _caches[path]
+
+
+class CachedClient(ClientWrapper):
+    """
+    Wraps any LLMClient with a persistent response cache
+
+    'read' serves cached responses and stores new ones; 'write' always calls
+    the provider and stores (refreshes) the result. Only complete responses
+    are stored: one missing a sample or any of its documents (e.g. truncated
+    at max tokens) is not, so a retried or resumed job calls the provider
+    again instead of replaying the same failure.
+    """
+
+    def __init__(self, client, cache, mode="read", outputs_per_response=1):
+        """
+        Args:
+            client:
+                LLMClient to cache
+            cache:
+                ResponseCache the responses are stored in
+            mode:
+                'read' or 'write'
+            outputs_per_response:
+                Number of <OUTPUT> documents a complete response contains
+        """
+        super().__init__(client)
+        if mode not in ("read", "write"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.cache = cache
+        self.mode = mode
+        self.outputs_per_response = outputs_per_response
+
+    def _key(self, prompt, n):
+        return cache_key(prompt, {**self.client.generation_params(), "n": n})
+
+    def _lookup(self, key):
+        if self.mode != "read":
+            return None
+        responses = self.cache.get(key)
+        if responses is not None:
+            logger.debug(f"Response cache hit {key[:12]}")
+        return responses
+
+    def _store(self, key, responses, n):
+        if len(responses) == n and all(
+            response_complete(response, self.outputs_per_response) for response in responses
+        ):
+            self.cache.put(key, responses)
+        else:
+            logger.debug(f"Not caching incomplete response {key[:12]}")
+
+    def generate_samples(self, prompt, n):
+        key = self._key(prompt, n)
+        responses = self._lookup(key)
+        if responses is None:
+            responses = self.client.generate_samples(prompt, n)
+            self._store(key, responses, n)
+        return responses
+
+    async def agenerate_samples(self, prompt, n):
+        key = self._key(prompt, n)
+        responses = self._lookup(key)
+        if responses is None:
+            responses = await self.client.agenerate_samples(prompt, n)
+            self._store(key, responses, n)
+        return responses
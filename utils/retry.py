@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from utils.llm_clients import ClientWrapper, error_status_code, retry_after
+
+"""
+retry.py - retries of transient LLM failures with backoff, jitter and a retry budget
+"""
+
+logger = logging.getLogger(__name__)
+
+# rate limiting, request timeout/conflict and server-side overload
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+# provider-specific additions (Anthropic reports overload as 529)
+PROVIDER_RETRYABLE_STATUS_CODES = {"claude": {529}}
+
+# SDK exception class names for requests that never got an HTTP response,
+# e.g. APITimeoutError, APIConnectionError, httpx ReadTimeout/RemoteProtocolError
+TRANSIENT_ERROR_MARKERS = ("timeout", "connect", "protocol")
+
+_budgets = {}
+_budgets_lock = threading.Lock()
+
+
+def is_retryable(error, provider=None):
+    """
+    Classify an exception from a provider call.
+
+    Rate limits, overload, timeouts and dropped connections are retryable.
+    Everything else (bad request, auth, not found, safety blocks, parsing
+    errors) is fatal: retrying would fail the same way.
+    """
+    status = error_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES or status in PROVIDER_RETRYABLE_STATUS_CODES.get(
+            provider, ()
+        )
+
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    name = type(error).__name__.lower()
+    return any(marker in name for marker in TRANSIENT_ERROR_MARKERS)
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of requests made, so an outage cannot
+    multiply the load on a provider that is already failing
+    """
+
+    def __init__(self, provider, ratio=0.2, min_retries=10):
+        """
+        Args:
+            provider:
+                Provider name, for logging
+            ratio:
+                Retries allowed per request sent
+            min_retries:
+                Retries allowed regardless of ratio, so small runs can retry
+        """
+        self.provider = provider
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def try_spend(self):
+        """
+        Take one retry from the budget; False if it is used up
+        """
+        with self.lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                self.exhausted += 1
+                return False
+            self.retries += 1
+            return True
+
+
+def get_retry_budget(provider, retry_config):
+    """
+    Return the process-wide RetryBudget for a provider, creating it on first use.
+
+    Args:
+        provider:
+            Provider name, used as the sharing key
+        retry_config:
+            llm.retry section of pipeline.yml
+    """
+    with _budgets_lock:
+        if provider not in _budgets:
+            _budgets[provider] = RetryBudget(
+                provider,
+                ratio=retry_config.get("budget_ratio", 0.2),
+                min_retries=retry_config.get("min_retries", 10),
+            )
+        return _budgets[provider]
+
+
+def retry_budgets():
+    """
+    Every RetryBudget created so far, for end-of-run reporting
+    """
+    with _budgets_lock:
+        return list(_budgets.values())
+
+
+class RetryingClient(ClientWrapper):
+    """
+    Wraps any LLMClient so retryable failures are retried with capped
+    exponential backoff and full jitter, honouring Retry-After when present
+    """
+
+    def __init__(self, client, budget, max_attempts=5, base_delay=1.0, max_delay=60.0):
+        super().__init__(client)
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def _backoff(self, error, attempt):
+        """
+        Seconds to wait before the next attempt, or None to give up and re-raise
+        """
+        if not is_retryable(error, self.client.provider):
+            logger.debug(f"Not retrying fatal {type(error).__name__}: {error}")
+            return None
+        if attempt >= self.max_attempts:
+            logger.warning(f"Giving up after {attempt} attempts: {error}")
+            return None
+        if not self.budget.try_spend():
+            logger.warning(f"Retry budget for {self.budget.provider} exhausted, not retrying: {error}")
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        delay = min(self.max_delay, max(delay, retry_after(error) or 0))
+        logger.warning(
+            f"Attempt {attempt}/{self.max_attempts} failed ({type(error).__name__}: {error}), "
+            f"retrying in {delay:.1f}s"
+        )
+        return delay
+
+    def generate_samples(self, prompt, n):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.budget.record_request()
+            try:
+                return self.client.generate_samples(prompt, n)
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+
+    async def agenerate_samples(self, prompt, n):
+        attempt = 0
+        while True:
+            attempt += 1
+            self.budget.record_request()
+            try:
+                return await self.client.agenerate_samples(prompt, n)
+            except Exception as e:
+                delay = self._backoff(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
@@ -0,0 +1,151 @@
+import logging
+import queue
+import threading
+
+"""
+stages.py - pipeline stages joined by bounded queues, so slow stages apply backpressure
+"""
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+# seconds between checks for a stopped consumer while waiting on a full queue
+_POLL_INTERVAL = 0.5
+
+
+class _Failed:
+    """
+    Exception raised by a producer, handed to the consumer to re-raise
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+def prefetch(items, func, workers=1, queue_size=64):
+    """
+    Apply func to items on worker threads ahead of the consumer.
+
+    Results are yielded in completion order as the consumer pulls them. At
+    most queue_size results wait in the queue, after which the workers
+    block, so a slow consumer bounds the work done ahead of it. An exception
+    from func is re-raised to the consumer. If the consumer stops early the
+    workers stop too.
+
+    Args:
+        items:
+            Iterable of inputs, consumed by the workers under a lock
+        func:
+            Called with each item on a worker thread
+        workers:
+            Number of worker threads
+        queue_size:
+            Maximum number of results waiting for the consumer
+    """
+    items = iter(items)
+    items_lock = threading.Lock()
+    results = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(result):
+        while not stopped.is_set():
+            try:
+                results.put(result, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def work():
+        try:
+            while not stopped.is_set():
+                with items_lock:
+                    item = next(items, _DONE)
+                if item is _DONE:
+                    break
+                put(func(item))
+        except Exception as e:
+            put(_Failed(e))
+        finally:
+            put(_DONE)
+
+    for i in range(workers):
+        threading.Thread(target=work, name=f"prefetch-{i}", daemon=True).start()
+
+    running = workers
+    try:
+        while running:
+            result = results.get()
+            if result is _DONE:
+                running -= 1
+            elif isinstance(result, _Failed):
+                raise result.error
+            else:
+                yield result
+    finally:
+        stopped.set()
+
+
+class Stage:
+    """
+    Pool of worker threads running submitted tasks from a bounded queue.
+
+    submit() blocks while the queue is full, so a stage that falls behind
+    slows the stage feeding it instead of buffering without limit. Tasks
+    should handle their own errors; anything they raise is logged and the
+    worker carries on.
+    """
+
+    def __init__(self, name, workers=1, queue_size=64):
+        """
+        Args:
+            name:
+                Stage name, for thread names and logging
+            workers:
+                Number of worker threads
+            queue_size:
+                Maximum number of tasks waiting to run
+        """
+        if workers < 1:
+            raise ValueError(f"{name} stage needs at least 1 worker, got {workers}")
+
+        self.name = name
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        logger.info(f"Started {name} stage with {workers} workers (queue size {queue_size})")
+
+    def _work(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is _DONE:
+                    return
+                func, args = task
+                func(*args)
+            except Exception:
+                logger.exception(f"Unhandled error in {self.name} stage")
+            finally:
+                self.tasks.task_done()
+
+    def submit(self, func, *args):
+        self.tasks.put((func, args))
+
+    def join(self):
+        """
+        Wait until every task submitted so far has run
+        """
+        self.tasks.join()
+
+    def close(self):
+        """
+        Run the remaining tasks, then stop the workers
+        """
+        for _ in self.threads:
+            self.tasks.put(_DONE)
+        for thread in self.threads:
+            thread.join()
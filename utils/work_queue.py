@@ -0,0 +1,227 @@
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+"""
+work_queue.py - SQLite job queue shared by worker processes on any number of hosts
+"""
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+
+def worker_id():
+    """
+    Identifier for this worker process, unique across hosts
+    """
+    return f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+
+
+class WorkQueue:
+    """
+    Plan jobs stored in a SQLite file that workers lease, heartbeat and complete.
+
+    A worker leases a job before calling the LLM for it. The lease lasts
+    lease_seconds and is renewed by the worker's heartbeat; a job whose
+    lease runs out (its worker died or hung) becomes available to other
+    workers again. Failed jobs are re-queued until they have been attempted
+    max_attempts times. Every state change is a single transaction, and
+    completing or failing a job only succeeds for the worker holding its
+    lease, so a job is never finished twice.
+
+    The database uses SQLite's default rollback journal rather than WAL,
+    which needs shared memory and does not work across network filesystems.
+    A connection is opened per operation, so the queue can be used from any
+    thread.
+    """
+
+    def __init__(self, path, lease_seconds=300.0, max_attempts=3):
+        """
+        Args:
+            path:
+                Queue database file, created if missing
+            lease_seconds:
+                How long a lease lasts without a heartbeat
+            max_attempts:
+                Leases of a job (including expired ones) before it is marked failed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS settings (id INTEGER PRIMARY KEY, settings TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY, job TEXT, status TEXT, attempts INTEGER, "
+                "worker TEXT, lease_expires REAL, error TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id)")
+
+    def _connect(self):
+        # isolation_level None so transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def populate(self, settings, jobs):
+        """
+        Store a plan's settings and jobs, unless the queue already holds a plan
+        Returns True if the jobs were added
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("SELECT COUNT(*) FROM settings").fetchone()[0]:
+                    conn.execute("ROLLBACK")
+                    return False
+                conn.execute(
+                    "INSERT INTO settings (id, settings) VALUES (1, ?)", (json.dumps(settings),)
+                )
+                conn.executemany(
+                    "INSERT INTO jobs (job, status, attempts) VALUES (?, ?, 0)",
+                    ((json.dumps(job, separators=(",", ":")), PENDING) for job in jobs),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"Queued {len(jobs)} jobs in {self.path}")
+        return True
+
+    def settings(self):
+        """
+        Settings of the queued plan, or None if the queue is empty
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT settings FROM settings WHERE id = 1").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lease(self, worker):
+        """
+        Lease the next pending job (or one whose lease has expired)
+        Returns (job_id, job) or None when nothing is available
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # expired leases that have used up their attempts fail instead of running again
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = 'lease expired' "
+                    "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                    (FAILED, LEASED, now, self.max_attempts),
+                )
+                row = conn.execute(
+                    "SELECT id, job FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_expires < ?) ORDER BY id LIMIT 1",
+                    (PENDING, LEASED, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (LEASED, worker, now + self.lease_seconds, row[0]),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, worker):
+        """
+        Renew every lease held by a worker; returns the number renewed
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE status = ? AND worker = ?",
+                (time.time() + self.lease_seconds, LEASED, worker),
+            )
+            return cursor.rowcount
+
+    def complete(self, job_id, worker):
+        """
+        Mark a leased job done; False if the worker no longer held its lease
+        """
+        with closing(self._connect()) as conn, conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires = NULL, error = NULL "
+                "WHERE id = ? AND status = ? AND worker = ?",
+                (DONE, job_id, LEASED, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error):
+        """
+        Re-queue a leased job after an error, or mark it failed once it has
+        been attempted max_attempts times
+        Returns the job's new status (PENDING or FAILED), or None if the
+        worker no longer held its lease
+        """
+        with closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT attempts FROM jobs WHERE id = ? AND status = ? AND worker = ?",
+                    (job_id, LEASED, worker),
+                ).fetchone()
+                status = None
+                if row is not None:
+                    status = FAILED if row[0] >= self.max_attempts else PENDING
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, lease_expires = NULL, error = ? WHERE id = ?",
+                        (status, str(error), job_id),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return status
+
+    def counts(self):
+        """
+        Number of jobs in each status
+        """
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0, **dict(rows)}
+
+
+class Heartbeat:
+    """
+    Background thread renewing a worker's leases every interval seconds
+    """
+
+    def __init__(self, queue, worker, interval):
+        self.queue = queue
+        self.worker = worker
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="queue-heartbeat", daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.worker)
+            except sqlite3.Error as e:
+                # a missed heartbeat is retried next interval; leases outlast several
+                logger.warning(f"Queue heartbeat failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()